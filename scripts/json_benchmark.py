@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""Compare the throughput of the registered JSON codecs on representative payloads.
+
+Usage: python scripts/json_benchmark.py [iterations] [codec ...]
+
+Codecs which can not be imported are skipped.  Output from each codec is checked against the
+standard library json module before timing.
+"""
+
+import sys
+import timeit
+
+from StringIO import StringIO
+
+from web.utils import codec
+
+
+payloads = dict(
+        call = dict(jsonrpc="2.0", method="wiki.page.get", params=["FrontPage", 3], id=1),
+        batch = [dict(jsonrpc="2.0", method="math.add", params=[i, i * 2], id=i) for i in range(50)],
+        document = dict(
+                name = u"Front Page",
+                tags = [u"wiki", u"home", u"r\xe9sum\xe9"],
+                revisions = [dict(id=i, author=u"alice", comment=u"Revision %d." % (i, ), size=i * 1024.5, minor=bool(i % 2), parent=None) for i in range(100)]
+            )
+    )
+
+
+def benchmark(name, iterations):
+    try:
+        instance = codec.use(name)
+    except ImportError:
+        print "%-12s not available" % (name, )
+        return
+    
+    reference = codec.Codec.wrap('json', __import__('json'))
+    
+    for label, payload in sorted(payloads.items()):
+        encoded = instance.dumps(payload)
+        
+        if reference.loads(encoded) != payload or instance.load(StringIO(encoded)) != payload:
+            print "%-12s %-10s output differs from the standard library" % (name, label)
+            continue
+        
+        dumps = min(timeit.repeat(lambda: instance.dumps(payload), number=iterations, repeat=3))
+        loads = min(timeit.repeat(lambda: instance.loads(encoded), number=iterations, repeat=3))
+        load = min(timeit.repeat(lambda: instance.load(StringIO(encoded)), number=iterations, repeat=3))
+        
+        print "%-12s %-10s dumps %8.1f us  loads %8.1f us  load %8.1f us" % (
+                name, label,
+                dumps / iterations * 1000000,
+                loads / iterations * 1000000,
+                load / iterations * 1000000
+            )
+
+
+if __name__ == '__main__':
+    iterations = int(sys.argv[1]) if sys.argv[1:] else 1000
+    names = sys.argv[2:] or sorted(codec.codecs)
+    
+    for name in names:
+        benchmark(name, iterations)
@@ -94,10 +94,12 @@ setup(
                         'main = web.core:Application.factory'
                     ],
                 'paste.paster_command': [
-                        'shell = web.commands.shell:ShellCommand'
+                        'shell = web.commands.shell:ShellCommand',
+                        'precompile = web.commands.precompile:PrecompileCommand'
                     ],
                 'webcore.command': [
-                        'shell = web.commands.shell:ShellCommand'
+                        'shell = web.commands.shell:ShellCommand',
+                        'precompile = web.commands.precompile:PrecompileCommand'
                     ],
                 'toscawidgets.host_frameworks': [
                         'webcore = web.extras.twframework:WebCoreHostFramework'
@@ -4,10 +4,10 @@ from unittest import TestCase
 import web.core
 import web.auth
 from web.core import Application
-from web.auth.middleware import WebAuth
+from web.auth.middleware import WebAuth, MemoryIdentities, TieredIdentities
 from marrow.util.bunch import Bunch
 
-from paste.registry import StackedObjectProxy
+from web.core.context import Context, ContextProxy, activate
 
 from common import PlainController, WebTestCase
 
@@ -25,6 +25,12 @@ local = remote_addr_in(['127.0.0.1', '::1', 'fe80::1%%lo0'])
 def lookup(identifier):
     return users[identifier] if identifier in users else None
 
+lookups = []
+
+def counting_lookup(identifier):
+    lookups.append(identifier)
+    return lookup(identifier)
+
 def authenticate(identifier, password):
     return (identifier, users[identifier]) if identifier in users and users[identifier]['pass'] == password else None
 
@@ -69,6 +75,9 @@ class RootController(PlainController):
     def force(self, username):
         return "ok" if web.auth.authenticate(username, None, force=True) else "error"
     
+    def name(self):
+        return web.auth.user['name'] if web.auth.user._current_obj() else "anonymous"
+    
     def kill(self):
         web.auth.deauthenticate()
         return "ok"
@@ -134,12 +143,148 @@ class TestAuthApp(WebTestCase):
         self.assertResponse('/local', body="local")
 
 
+class TestIdentityCache(WebTestCase):
+    app = Application.factory(root=RootController, **dict(test_config, **{
+            'web.auth.lookup': counting_lookup,
+            'web.auth.cache': 'memory'
+        }))
+    config = web.auth.config
+    
+    def setUp(self):
+        self.previous, web.auth.config = web.auth.config, self.config
+        del lookups[:]
+    
+    def tearDown(self):
+        web.auth.config = self.previous
+    
+    def test_cached(self):
+        self.assertResponse('/force?username=amcgregor', body="ok")
+        self.assertEqual(len(lookups), 1)
+        
+        for i in range(3):
+            self.assertResponse('/authenticated', body="authenticated")
+        
+        self.assertEqual(len(lookups), 1)
+    
+    def test_invalidated(self):
+        self.assertResponse('/force?username=amcgregor', body="ok")
+        self.assertResponse('/kill', body="ok")
+        self.assertResponse('/authenticated', '307 Temporary Redirect', 'text/plain')
+        
+        self.assertResponse('/authenticate?username=amcgregor&password=foo', body="ok")
+        self.assertResponse('/authenticated', body="authenticated")
+        self.assertEqual(len(lookups), 1)
+    
+    def test_miss(self):
+        self.config.cache.cache.clear()
+        
+        self.assertResponse('/force?username=amcgregor', body="ok")
+        self.config.cache.cache.clear()
+        
+        self.assertResponse('/name', body="Alice Bevan-McGregor")
+        self.assertResponse('/name', body="Alice Bevan-McGregor")
+        self.assertEqual(lookups, ['amcgregor', 'amcgregor'])
+    
+    def test_tiered(self):
+        first, second = MemoryIdentities(), MemoryIdentities()
+        tiers = TieredIdentities(first, second)
+        
+        second.set('session', ('amcgregor', users['amcgregor']))
+        self.assertEqual(tiers.get('session'), ('amcgregor', users['amcgregor']))
+        self.assertEqual(first.get('session'), ('amcgregor', users['amcgregor']))
+        
+        tiers.invalidate('session')
+        self.assertEqual(tiers.get('session'), None)
+    
+    def test_configuration(self):
+        WebAuth(app_root, dict(test_config, **{'web.auth.cache': 'memory, beaker', 'web.auth.cache.ttl': '60'}), 'web.auth.')
+        
+        self.assertTrue(isinstance(web.auth.config.cache, TieredIdentities))
+        self.assertEqual(web.auth.config.cache.tiers[0].cache.ttl, 60)
+
+
+class TestLazyUser(WebTestCase):
+    app = Application.factory(root=RootController, **dict(test_config, **{'web.auth.lookup': counting_lookup}))
+    config = web.auth.config
+    
+    def setUp(self):
+        self.previous, web.auth.config = web.auth.config, self.config
+        del lookups[:]
+    
+    def tearDown(self):
+        web.auth.config = self.previous
+    
+    def test_unused(self):
+        self.assertResponse('/force?username=amcgregor', body="ok")
+        self.assertResponse('/', body="success")
+        self.assertEqual(len(lookups), 1)
+    
+    def test_predicate(self):
+        self.assertResponse('/force?username=amcgregor', body="ok")
+        self.assertResponse('/authenticated', body="authenticated")
+        self.assertResponse('/anonymous', '307 Temporary Redirect', 'text/plain')
+        self.assertEqual(len(lookups), 3)
+    
+    def test_removed(self):
+        self.assertResponse('/force?username=amcgregor', body="ok")
+        user = users.pop('amcgregor')
+        
+        try:
+            self.assertResponse('/authenticated', '307 Temporary Redirect', 'text/plain')
+            self.assertResponse('/anonymous', body="anonymous")
+        
+        finally:
+            users['amcgregor'] = user
+    
+    def test_memoized(self):
+        self.assertResponse('/force?username=amcgregor', body="ok")
+        self.assertResponse('/name', body="Alice Bevan-McGregor")
+        self.assertEqual(len(lookups), 2)
+    
+    def test_anonymous(self):
+        self.assertResponse('/name', body="anonymous")
+        self.assertEqual(len(lookups), 0)
+
+
+class TestDeferredSession(WebTestCase):
+    app = Application.factory(root=RootController, **dict(test_config, **{'web.auth.defer': True}))
+    config = web.auth.config
+    
+    def setUp(self):
+        self.previous, web.auth.config = web.auth.config, self.config
+    
+    def tearDown(self):
+        web.auth.config = self.previous
+    
+    def test_anonymous(self):
+        response = self.assertResponse('/', body="success")
+        self.assertEqual(response.headers.getall('Set-Cookie'), [])
+        
+        response = self.assertResponse('/authenticated', '307 Temporary Redirect', 'text/plain')
+        self.assertEqual(response.headers.getall('Set-Cookie'), [])
+    
+    def test_authenticated(self):
+        response = self.assertResponse('/force?username=amcgregor', body="ok")
+        self.assertNotEqual(response.headers.getall('Set-Cookie'), [])
+        
+        self.assertResponse('/authenticated', body="authenticated")
+        self.assertResponse('/kill', body="ok")
+        self.assertResponse('/authenticated', '307 Temporary Redirect', 'text/plain')
+    
+    def test_has_cookie(self):
+        wa = WebAuth(app_root, test_config, 'web.auth.')
+        
+        self.assertTrue(wa.has_cookie({'HTTP_COOKIE': 'a=1; session=abc'}, 'session'))
+        self.assertFalse(wa.has_cookie({'HTTP_COOKIE': 'xsession=abc'}, 'session'))
+        self.assertFalse(wa.has_cookie({}, 'session'))
+
+
 class TestAnonymousPredicates(TestCase):
     def setUp(self):
         web.auth.user = None
     
     def tearDown(self):
-        web.auth.user = StackedObjectProxy(name="user")
+        web.auth.user = ContextProxy("user")
     
     def test_basics(self):
         self.assertRaises(NotImplementedError, lambda: bool(web.auth.Predicate()))
@@ -173,7 +318,7 @@ class TestAuthenticatedPredicates(TestCase):
         web.auth.user = sadict(name="user", groups=["admin"])
 
     def tearDown(self):
-        web.auth.user = StackedObjectProxy(name="user")
+        web.auth.user = ContextProxy("user")
 
     def test_anonymous(self):
         self.failIf(web.auth.anonymous)
@@ -183,3 +328,77 @@ class TestAuthenticatedPredicates(TestCase):
         self.failUnless(is_me)
         self.failUnless(user_in(['jrh', 'user']))
         self.failUnless(member_of('admin'))
+
+
+class TestPredicateMemo(TestCase):
+    def setUp(self):
+        self.calls = []
+        self.predicate = web.auth.CustomPredicate(lambda u, r: self.calls.append(1) or True)
+        self.previous = activate(Context(dict()))
+    
+    def tearDown(self):
+        activate(self.previous)
+    
+    def test_memoized(self):
+        self.failUnless(self.predicate)
+        self.failUnless(web.auth.All(self.predicate, web.auth.Not(web.auth.never)))
+        self.failUnless(web.auth.evaluate(self.predicate))
+        self.assertEqual(len(self.calls), 1)
+    
+    def test_reset(self):
+        self.failUnless(self.predicate)
+        web.auth.predicates.reset()
+        self.failUnless(self.predicate)
+        self.assertEqual(len(self.calls), 2)
+    
+    def test_no_request(self):
+        activate(Context())
+        self.failUnless(self.predicate)
+        self.failUnless(self.predicate)
+        self.assertEqual(len(self.calls), 2)
+
+
+class TestCompiledPredicates(TestCase):
+    def test_flatten(self):
+        a, b, c = is_me, local, member_of('admin')
+        
+        predicate = web.auth.compiled(web.auth.All(a, web.auth.All(b, web.auth.always, web.auth.All(c))))
+        self.failUnless(isinstance(predicate, web.auth.All))
+        self.assertEqual(predicate.args, (a, b, c))
+        
+        predicate = web.auth.compiled(web.auth.Any(web.auth.never, web.auth.Any(a, b)))
+        self.failUnless(isinstance(predicate, web.auth.Any))
+        self.assertEqual(predicate.args, (a, b))
+    
+    def test_unchanged(self):
+        predicate = web.auth.All(is_me, local)
+        self.failUnless(web.auth.compiled(predicate) is predicate)
+    
+    def test_subclass(self):
+        class Staff(web.auth.All):
+            def __init__(self):
+                super(Staff, self).__init__(web.auth.authenticated, web.auth.anonymous, web.auth.always)
+        
+        predicate = Staff()
+        self.failUnless(web.auth.compiled(predicate) is predicate)
+        self.failUnless(web.auth.compiled(web.auth.Any(web.auth.never, predicate)) is predicate)
+        
+        web.auth.authorize(predicate)(lambda: None)
+    
+    def test_constants(self):
+        self.failUnless(web.auth.compiled(web.auth.All(is_me, web.auth.never)) is web.auth.never)
+        self.failUnless(web.auth.compiled(web.auth.Any(is_me, web.auth.All(web.auth.always))) is web.auth.always)
+        self.failUnless(web.auth.compiled(web.auth.All(web.auth.always, is_me)) is is_me)
+        self.failUnless(web.auth.compiled(web.auth.Any()) is web.auth.never)
+    
+    def test_negation(self):
+        self.failUnless(web.auth.compiled(web.auth.Not(web.auth.Not(is_me))) is is_me)
+        self.failUnless(web.auth.compiled(web.auth.Not(web.auth.All(web.auth.always))) is web.auth.never)
+        
+        predicate = web.auth.Not(is_me)
+        self.failUnless(web.auth.compiled(predicate) is predicate)
+    
+    def test_values(self):
+        self.assertEqual(user_in(['jrh', 'user']).values, frozenset(['jrh', 'user']))
+        self.assertEqual(user_in('jrh').values, frozenset(['jrh']))
+        self.assertEqual(user_in([['jrh']]).values, [['jrh']])
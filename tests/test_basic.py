@@ -41,9 +41,23 @@ class NestedController(PlainController):
         return "success"
 
 
+class FirstController(PlainController):
+    def go(self, **kw):
+        return "first"
+
+
+class SecondController(PlainController):
+    def go(self, **kw):
+        return "second"
+
+
 class RootController(PlainController):
     nested = NestedController()
 
+    @property
+    def chosen(self):
+        return SecondController() if web.core.request.params.get('second') else FirstController()
+
     def index(self, *args, **kw):
         return "success"
 
@@ -123,6 +137,28 @@ class TestBasicDispatch(WebTestCase):
     def test_return_none(self):
         self.assertResponse('/empty', '200 OK', body='')
 
+    def test_property(self):
+        self.assertResponse('/chosen/go', body="first")
+        self.assertResponse('/chosen/go?second=1', body="second")
+        self.assertResponse('/chosen/go', body="first")
+
+
+class TestCompiledDispatch(TestBasicDispatch):
+    app = Application.factory(root=RootController, **dict(test_config, **{'web.dispatch.compiled': True}))
+
+
+class TestMemoizedDispatch(TestBasicDispatch):
+    app = Application.factory(root=RootController, **dict(test_config, **{'web.dispatch.cache': 10}))
+    
+    def test_repeated(self):
+        for i in range(3):
+            self.assertResponse('/arg/bar', body="got bar")
+            self.assertResponse('/arg/baz', body="got baz")
+            self.assertResponse('/format.json', body="json")
+            self.assertResponse('/nested/', body="success")
+            self.assertResponse('/nested', '301 Moved Permanently', 'text/plain')
+            self.assertResponse('/nex', '404 Not Found', 'text/plain')
+
 
 class CustomDialect(web.core.Dialect):
     def __call__(self, request):
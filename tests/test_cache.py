@@ -0,0 +1,51 @@
+# encoding: utf-8
+
+import time
+
+from unittest import TestCase
+
+from web.utils.cache import LRUCache
+
+
+
+class TestLRUCache(TestCase):
+    def test_eviction(self):
+        cache = LRUCache(2)
+        cache['a'] = 1
+        cache['b'] = 2
+        
+        self.assertEqual(cache['a'], 1)
+        
+        cache['c'] = 3
+        
+        self.assertEqual(sorted(cache), ['a', 'c'])
+        self.assertRaises(KeyError, lambda: cache['b'])
+    
+    def test_disabled(self):
+        cache = LRUCache(0)
+        cache['a'] = 1
+        
+        self.assertEqual(len(cache), 0)
+        self.assertFalse('a' in cache)
+    
+    def test_expiry(self):
+        cache = LRUCache(10, ttl=60)
+        cache.set('a', 1)
+        cache.set('b', 2, ttl=0.01)
+        
+        time.sleep(0.02)
+        
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('b', 'missing'), 'missing')
+    
+    def test_invalidate(self):
+        cache = LRUCache(10)
+        
+        for key in ('/foo', '/foo/bar', '/baz'):
+            cache[key] = True
+        
+        self.assertEqual(cache.invalidate(lambda key: key.startswith('/foo')), 2)
+        self.assertEqual(list(cache), ['/baz'])
+        
+        self.assertEqual(cache.pop('/baz'), True)
+        self.assertEqual(cache.invalidate(), 0)
@@ -0,0 +1,203 @@
+# encoding: utf-8
+
+import threading
+
+from unittest import TestCase
+
+from paste.registry import StackedObjectProxy
+from webob import Request, Response
+
+import web.core
+from web.core import Application, Controller
+from web.core.context import Context, ContextProxy, Registry, ContextMiddleware, current, activate, use
+
+from common import PlainController, WebTestCase
+
+
+legacy = StackedObjectProxy(name="legacy")
+custom = ContextProxy("custom")
+
+
+def wsgi_app(environ, start_response):
+    environ['paste.registry'].register(legacy, "legacy value")
+    environ['paste.registry'].register(custom, "custom value")
+    
+    start_response('200 OK', [('Content-type', 'text/plain')])
+    return ['%s %s %s' % (legacy.upper(), custom.upper(), current() is environ['web.context'])]
+
+
+class RootController(PlainController):
+    def index(self):
+        context = current()
+        return "%s %s" % (context.request is web.core.request._current_obj(), context.response is web.core.response._current_obj())
+
+
+class DirectController(Controller):
+    def index(self):
+        response = Response("direct", content_type="text/plain")
+        response.headers['X-Assigned'] = repr(current())
+        return response
+
+
+def raw_app(environ, start_response):
+    start_response('200 OK', [('Content-type', 'text/plain')])
+    return [repr(current())]
+
+
+test_config = {'debug': False, 'web.widgets': False, 'web.sessions': False, 'web.compress': False, 'web.static': False}
+
+
+class TestContextProxy(TestCase):
+    def setUp(self):
+        self.previous = activate(Context())
+    
+    def tearDown(self):
+        activate(self.previous)
+    
+    def test_unregistered(self):
+        self.assertRaises(TypeError, lambda: web.core.request._current_obj())
+        self.assertRaises(TypeError, lambda: custom._current_obj())
+        self.assertTrue('ContextProxy' in repr(custom))
+    
+    def test_slot(self):
+        web.core.session._push_object(dict(foo="bar"))
+        
+        self.assertEqual(current().session, dict(foo="bar"))
+        self.assertEqual(web.core.session['foo'], "bar")
+        self.assertTrue('foo' in web.core.session)
+        self.assertEqual(len(web.core.session), 1)
+        
+        web.core.session._pop_object()
+        self.assertRaises(TypeError, lambda: web.core.session._current_obj())
+    
+    def test_extras(self):
+        custom._push_object([1, 2])
+        
+        self.assertEqual(current().extras, dict(custom=[1, 2]))
+        self.assertEqual(list(custom), [1, 2])
+        
+        custom._pop_object()
+        self.assertRaises(TypeError, lambda: custom._current_obj())
+    
+    def test_registry(self):
+        registry = Registry()
+        registry.prepare()
+        registry.register(legacy, 27)
+        registry.register(custom, 42)
+        
+        self.assertEqual(legacy._current_obj(), 27)
+        self.assertEqual(custom._current_obj(), 42)
+        
+        registry.cleanup()
+        self.assertRaises(TypeError, lambda: legacy._current_obj())
+    
+    def test_lazy(self):
+        calls = []
+        
+        def factory():
+            calls.append(True)
+            return "lazy value"
+        
+        context = current()
+        context.lazy('custom', factory)
+        context.lazy('translator', factory)
+        
+        self.assertFalse(context.assigned('custom'))
+        self.assertEqual(repr(context), "Context()")
+        self.assertEqual(custom._current_obj(), "lazy value")
+        self.assertEqual(web.core.translator._current_obj(), "lazy value")
+        self.assertEqual(custom._current_obj(), "lazy value")
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(repr(context), "Context(translator)")
+    
+    def test_lazy_registry(self):
+        registry = Registry()
+        registry.prepare()
+        registry.lazy(custom, lambda: 42)
+        registry.lazy(legacy, lambda: 27)
+        
+        self.assertFalse(current().assigned('custom'))
+        self.assertEqual(custom._current_obj(), 42)
+        self.assertEqual(legacy._current_obj(), 27)
+        
+        registry.cleanup()
+    
+    def test_register_overrides_lazy(self):
+        current().lazy('custom', lambda: self.fail("Factory should not be called."))
+        custom._push_object(42)
+        self.assertEqual(custom._current_obj(), 42)
+    
+    def test_defaults(self):
+        context = current()
+        context.environ = Request.blank('/foo').environ
+        
+        self.assertEqual(repr(context), "Context()")
+        self.assertRaises(TypeError, lambda: web.core.session._current_obj())
+        self.assertEqual(web.core.request.path_info, '/foo')
+        self.assertTrue(context.response.request is context.request)
+        self.assertEqual(repr(context), "Context(request, response)")
+    
+    def test_backend(self):
+        try:
+            use('threading:local')
+            self.assertEqual(current(), None)
+        finally:
+            use()
+
+
+class TestContextMiddleware(WebTestCase):
+    app = ContextMiddleware(wsgi_app)
+    
+    def test_registration(self):
+        self.assertResponse('/', body="LEGACY VALUE CUSTOM VALUE True")
+        self.assertEqual(current(), None)
+
+
+class TestPasteRegistry(WebTestCase):
+    app = Application.factory(root=RootController, **dict(test_config, **{'web.registry': True}))
+    
+    def test_index(self):
+        self.assertResponse('/', body="True True")
+    
+    def test_paste_debug(self):
+        self.assertResponse('/_test_vars')
+
+
+class TestContextApplication(WebTestCase):
+    app = Application.factory(root=RootController, **test_config)
+    
+    def test_index(self):
+        self.assertResponse('/', body="True True")
+    
+    def test_threads(self):
+        results = []
+        
+        def worker():
+            results.append(current())
+        
+        activate(Context())
+        
+        try:
+            thread = threading.Thread(target=worker)
+            thread.start()
+            thread.join()
+        
+        finally:
+            activate(None)
+        
+        self.assertEqual(results, [None])
+
+
+class TestLazyApplication(WebTestCase):
+    app = Application.factory(root=raw_app, **test_config)
+    
+    def test_raw(self):
+        self.assertResponse('/', body="Context()")
+
+
+class TestLazyResponse(WebTestCase):
+    app = Application.factory(root=DirectController, **test_config)
+    
+    def test_direct_response(self):
+        response = self.assertResponse('/', body="direct")
+        self.assertEqual(response.headers['X-Assigned'], "Context(request)")
@@ -6,6 +6,7 @@ from webob import Request
 
 import web
 from web.core import Application, Controller
+from web.core.dialects.core import invalidate
 
 from common import PlainController, WebTestCase
 
@@ -45,6 +46,10 @@ class RootController(PlainController):
 test_config = {'debug': True, 'web.widgets': False, 'web.sessions': False, 'web.compress': False, 'web.static': False}
 
 
+class CachedRootController(RootController):
+    __cacheable_lookup__ = True
+
+
 class CRUDDispatch(WebTestCase):
     app = Application.factory(root=RootController, **test_config)
     
@@ -60,3 +65,46 @@ class CRUDDispatch(WebTestCase):
     def test_default(self):
         self.assertResponse('/catchall/foo/bar', body="default controller for foo bar")
         self.assertResponse('/catchall/_private', body="default controller for _private")
+
+
+class CompiledCRUDDispatch(CRUDDispatch):
+    root = RootController()
+    app = Application.factory(root=root, **dict(test_config, **{'web.dispatch.compiled': True}))
+    
+    def test_table(self):
+        table = self.root.__table__()
+        
+        self.assertTrue(table is not None)
+        self.assertTrue('create' in table.children)
+        self.assertTrue('catchall' in table.children)
+        self.assertTrue(table.children['catchall'][0] is not None)
+        self.assertFalse('__lookup__' in table.children)
+
+
+class MemoizedCRUDDispatch(CRUDDispatch):
+    root = CachedRootController()
+    app = Application.factory(root=root, **dict(test_config, **{'web.dispatch.cache': 10}))
+    
+    plain = RootController()
+    plain_app = Application.factory(root=plain, **dict(test_config, **{'web.dispatch.cache': 10}))
+    
+    def test_memo(self):
+        memo = self.root.__memo__()
+        invalidate(self.root)
+        
+        self.assertResponse('/Dole/Bob/modify', body="modifying Bob Dole")
+        self.assertResponse('/Dole/Bob/modify', body="modifying Bob Dole")
+        self.assertResponse('/catchall/foo/bar', body="default controller for foo bar")
+        self.assertResponse('/catchall/foo/baz', body="default controller for foo baz")
+        
+        self.assertEqual(sorted(memo), ['/Dole/Bob/modify', '/catchall/foo'])
+        self.assertTrue(memo.get('/Dole/Bob/modify').exact)
+        self.assertFalse(memo.get('/catchall/foo').exact)
+        
+        self.assertEqual(invalidate(self.root, '/catchall'), 1)
+        self.assertEqual(list(memo), ['/Dole/Bob/modify'])
+    
+    def test_uncacheable_lookup(self):
+        response = Request.blank('/Dole/Bob/').get_response(self.plain_app)
+        self.assertEqual(response.body, "viewing Bob Dole")
+        self.assertEqual(len(self.plain.__memo__()), 0)
@@ -1,5 +1,9 @@
 # encoding: utf-8
 
+import os
+import shutil
+import tempfile
+
 from unittest import TestCase
 
 from webob import Request
@@ -10,8 +14,11 @@ from web.core import Application, Controller, request
 
 from common import PlainController, WebTestCase
 
-from sqlalchemy import Column, Unicode
+from sqlalchemy import Column, Unicode, create_engine
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.pool import QueuePool
+
+from web.db.sa import ReplicaRouter, RoutingSession
 
 
 
@@ -59,6 +66,13 @@ class RootController(PlainController):
     def http_ok(self):
         raise web.core.http.HTTPOk()
     
+    def sessions(self, use=False):
+        if use:
+            session.query(Foo).count()
+            session.query(Foo).count()
+        
+        return str(request.environ['web.db.sessions'])
+    
     def clear(self):
         for i in session.query(Foo).all():
             session.delete(i)
@@ -94,6 +108,13 @@ class RootController(PlainController):
     
     def list(self):
         return u", ".join([i.name for i in session.query(Foo).order_by('name').all()])
+    
+    def streamed(self):
+        def generate():
+            yield "before "
+            yield str(session.query(Foo).count())
+        
+        return generate()
 
 
 test_config = {
@@ -128,9 +149,124 @@ class TestSASession(WebTestCase):
         self.assertResponse('/http_exception', '204 No Content', 'text/html')
 
 
+class TestSALazySession(WebTestCase):
+    app = app
+    
+    def test_unused(self):
+        self.assertResponse('/sessions', body='0')
+    
+    def test_used(self):
+        self.assertResponse('/sessions?use=1', body='1')
+
+
+ReplicaBase = declarative_base()
+replica_session = StackedObjectProxy()
+
+
+class Bar(ReplicaBase):
+    __tablename__ = 'bar'
+    
+    name = Column(Unicode(250), primary_key=True)
+
+
+class ReplicaModel(object):
+    metadata = ReplicaBase.metadata
+
+
+class ReplicaController(PlainController):
+    def list(self):
+        return u", ".join([i.name for i in replica_session.query(Bar).order_by('name').all()])
+    
+    def written(self):
+        replica_session.add(Bar(name=u"written"))
+        replica_session.flush()
+        
+        result = self.list()
+        replica_session.rollback()
+        
+        return result
+
+
+class TestSAReplicas(WebTestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.path = tempfile.mkdtemp()
+        urls = []
+        
+        for name in ('primary', 'replica-1', 'replica-2'):
+            url = 'sqlite:///' + os.path.join(cls.path, name + '.db')
+            urls.append(url)
+            
+            engine = create_engine(url)
+            ReplicaBase.metadata.create_all(bind=engine)
+            engine.execute(Bar.__table__.insert(), name=unicode(name))
+            engine.dispose()
+        
+        cls.app = Application.factory(root=ReplicaController, **{
+                'debug': False,
+                'web.widgets': False,
+                'web.sessions': False,
+                'web.compress': False,
+                'web.static': False,
+                'db.connections': 'replicated',
+                'db.replicated.engine': 'sqlalchemy',
+                'db.replicated.model': ReplicaModel(),
+                'db.replicated.session': replica_session,
+                'db.replicated.url': urls[0],
+                'db.replicated.replicas': ", ".join(urls[1:]),
+            })
+    
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.path)
+    
+    def test_safe_method_reads_replicas(self):
+        # The router is shared with other tests, so the replica it starts from is not fixed.
+        bodies = [self.assertResponse('/list').body for i in range(3)]
+        
+        self.assertEqual(sorted(bodies[:2]), ["replica-1", "replica-2"])
+        self.assertEqual(bodies[2], bodies[0])
+    
+    def test_unsafe_method_uses_primary(self):
+        self.assertPostResponse('/list', dict(), body="primary")
+    
+    def test_write_switches_to_primary(self):
+        self.assertResponse('/written', body="primary, written")
+        self.assertPostResponse('/list', dict(), body="primary")
+
+
+class TestReplicaRouter(TestCase):
+    def test_round_robin(self):
+        router = ReplicaRouter(['a', 'b'])
+        self.assertEqual([router.choose() for i in range(3)], ['a', 'b', 'a'])
+    
+    def test_least_connections(self):
+        engines = [create_engine('sqlite://', poolclass=QueuePool) for i in range(2)]
+        router = ReplicaRouter(engines, 'leastconn')
+        
+        connection = engines[0].connect()
+        
+        try:
+            self.assertTrue(router.choose() is engines[1])
+        finally:
+            connection.close()
+    
+    def test_unknown_strategy(self):
+        self.assertRaises(ValueError, ReplicaRouter, [], 'random')
+    
+    def test_primary_without_router(self):
+        self.assertTrue(RoutingSession().primary)
+
+
 class TestSAOperations(WebTestCase):
     app = app
     
+    def test_streamed(self):
+        self.assertResponse('/clear', '200 OK', 'text/plain', body="ok")
+        self.assertPostResponse('/create', dict(name="foo"), '200 OK', 'text/plain', body="ok")
+        self.assertResponse('/streamed', '200 OK', body="before 1")
+        self.assertPostResponse('/delete', dict(name="foo"), '200 OK', 'text/plain', body="ok")
+    
     def test_successful_operations(self):
         self.assertResponse('/clear', '200 OK', 'text/plain', body="ok")
         self.assertPostResponse('/create', dict(name="foo"), '200 OK', 'text/plain', body="ok")
@@ -153,25 +289,25 @@ class TestSAOperations(WebTestCase):
     def test_bad_rename(self):
         self.assertResponse('/clear', '200 OK', 'text/plain', body="ok")
         self.assertResponse('/list', '200 OK', 'text/plain', body="")
-
+        
         self.assertPostResponse('/create', dict(name="foo"), '200 OK', 'text/plain', body="ok")
         self.assertResponse('/list', '200 OK', 'text/plain', body="foo")
         
         self.assertPostResponse('/rename', dict(name="foo", newname="baz", die="HTTPInternalServerError"),
                 '500 Internal Server Error', 'text/plain')
-
+        
         self.assertResponse('/list', '200 OK', 'text/plain', body="foo")
-
+    
     def test_bad_delete(self):
         self.assertResponse('/clear', '200 OK', 'text/plain', body="ok")
         self.assertResponse('/list', '200 OK', 'text/plain', body="")
-
+        
         self.assertPostResponse('/create', dict(name="foo"), '200 OK', 'text/plain', body="ok")
         self.assertResponse('/list', '200 OK', 'text/plain', body="foo")
         
         self.assertPostResponse('/delete', dict(name="foo", die="HTTPInternalServerError"),
                 '500 Internal Server Error', 'text/plain')
-
+        
         self.assertResponse('/list', '200 OK', 'text/plain', body="foo")
         self.assertPostResponse('/delete', dict(name="foo"), '200 OK', 'text/plain', body="ok")
         self.assertResponse('/list', '200 OK', 'text/plain', body="")
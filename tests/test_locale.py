@@ -1,11 +1,18 @@
 # encoding: utf-8
 from __future__ import unicode_literals
 
+import os
+import struct
+import tempfile
+
 import web.core
 
-from gettext import NullTranslations
+from unittest import TestCase
+from gettext import NullTranslations, GNUTranslations, translation
 from web.core import Application
-from web.core.locale import L_, N_, _, __, ugettext, gettext, ngettext, ungettext, get_translator, set_lang, get_lang
+from web.core.context import Context, activate
+from web.core.locale import L_, N_, _, __, ugettext, gettext, ngettext, ungettext, get_translator, set_lang, get_lang, negotiate, translate
+from web.utils.catalog import MMapTranslations
 from common import PlainController, WebTestCase
 
 
@@ -64,6 +71,7 @@ test_config = {'debug': True, 'web.locale.i18n': True, 'web.sessions': True,
 
 class TestI18n(WebTestCase):
     app = Application.factory(root=RootController, **test_config)
+    config = dict(web.core.config)
     environ = {'HTTP_ACCEPT_LANGUAGE': 'fi, en-US, en'}
 
     def test_gettext(self):
@@ -106,6 +114,32 @@ class TestI18n(WebTestCase):
         tr = get_translator(None, {})
         assert isinstance(tr, NullTranslations)
 
+    def test_translator_cached(self):
+        tr = get_translator(['fi', 'en'], self.config)
+        assert get_translator(['fi', 'en'], self.config) is tr
+        assert get_translator(['en', 'fi'], self.config) is not tr
+        self.assertEqual(tr.ugettext('This works!'), 'Tämä toimii!')
+
+    def test_translator_pruned(self):
+        tr = get_translator(['de', 'fi_FI'], self.config)
+        self.assertEqual(tr.lang, ['de', 'fi_FI'])
+        self.assertEqual(tr.ugettext('This works!'), 'Tämä toimii!')
+
+    def test_negotiate(self):
+        self.assertEqual(negotiate('fi;q=0.5, en-us, de;q=0'), ('en_US', 'en', 'fi'))
+        self.assertEqual(negotiate('fi;q=0.5, en-us, de;q=0', frozenset(['en', 'fi'])), ('en', 'fi'))
+        self.assertEqual(negotiate('*, sv;q=0.9, fi;q=0.9, sv-FI;q=bad'), ('sv', 'fi'))
+        self.assertEqual(negotiate(''), ())
+
+    def test_negotiate_cached(self):
+        languages = negotiate('fi-FI, en;q=0.8')
+        assert negotiate('fi-FI, en;q=0.8') is languages
+
+    def test_translator_unsupported(self):
+        tr = get_translator(['de'], self.config)
+        assert isinstance(tr, NullTranslations)
+        self.assertEqual(tr.ugettext('This works!'), 'This works!')
+
 
 class TestI18nSession(WebTestCase):
     app = Application.factory(root=RootController, **test_config)
@@ -122,19 +156,135 @@ class TestI18nSession(WebTestCase):
         self.assertEqual(resp1.body, resp2.body)
 
     def test_set_lang(self):
-        self.assertResponse('/get_lang', _environ=self.environ, body='fi,en-US,en,en,en')
+        self.assertResponse('/get_lang', _environ=self.environ, body='fi,en')
         self.assertResponse('/set_lang?l=en', _environ=self.environ, body='This works!')
         self.assertResponse('/gettext', _environ=self.environ, body='This works!'.encode('utf-8'))
-        self.assertResponse('/get_lang', _environ=self.environ, body='en,fi,en-US,en,en,en')
+        self.assertResponse('/get_lang', _environ=self.environ, body='en,fi')
         self.assertResponse('/set_lang?l=fi', _environ=self.environ, body='Tämä toimii!'.encode('utf-8'))
         self.assertResponse('/gettext', _environ=self.environ, body='Tämä toimii!'.encode('utf-8'))
-        self.assertResponse('/get_lang', _environ=self.environ, body='fi,fi,en-US,en,en,en')
+        self.assertResponse('/get_lang', _environ=self.environ, body='fi,en')
 
     def test_set_lang_default(self):
-        self.assertResponse('/get_lang', _environ=self.environ, body='fi,en-US,en,en,en')
+        self.assertResponse('/get_lang', _environ=self.environ, body='fi,en')
         self.assertResponse('/set_lang?l=en', _environ=self.environ, body='This works!')
         self.assertResponse('/gettext', _environ=self.environ, body='This works!'.encode('utf-8'))
-        self.assertResponse('/get_lang', _environ=self.environ, body='en,fi,en-US,en,en,en')
+        self.assertResponse('/get_lang', _environ=self.environ, body='en,fi')
         self.assertResponse('/set_lang', _environ=self.environ, body='Tämä toimii!'.encode('utf-8'))
         self.assertResponse('/gettext', _environ=self.environ, body='Tämä toimii!'.encode('utf-8'))
-        self.assertResponse('/get_lang', _environ=self.environ, body='fi,en-US,en,en,en')
+        self.assertResponse('/get_lang', _environ=self.environ, body='fi,en')
+
+
+class CountingTranslations(NullTranslations):
+    def __init__(self, prefix):
+        NullTranslations.__init__(self)
+        self.prefix = prefix
+        self.calls = 0
+
+    def ugettext(self, message):
+        self.calls += 1
+        return self.prefix + message
+
+    def gettext(self, message):
+        self.calls += 1
+        return (self.prefix + message).encode('utf-8')
+
+
+class TestLazy(TestCase):
+    def setUp(self):
+        self.context = Context()
+        self.context.translator = CountingTranslations('fi:')
+        self.previous = activate(self.context)
+
+    def tearDown(self):
+        activate(self.previous)
+
+    def test_memoized(self):
+        message = L_('Save')
+        translator = self.context.translator
+
+        self.assertEqual(unicode(message), 'fi:Save')
+        self.assertEqual(message + '!', 'fi:Save!')
+        self.assertEqual(message.upper(), 'FI:SAVE')
+        self.assertEqual(translator.calls, 1)
+
+        self.assertEqual(str(message), b'fi:Save')
+        self.assertEqual(str(message), b'fi:Save')
+        self.assertEqual(translator.calls, 2)
+
+    def test_translator_changed(self):
+        message = L_('Save')
+        self.assertEqual(unicode(message), 'fi:Save')
+
+        self.context.translator = CountingTranslations('sv:')
+        self.assertEqual(unicode(message), 'sv:Save')
+
+    def test_translate(self):
+        labels = [L_('Save'), 'Cancel']
+
+        self.assertEqual(translate(labels), ['fi:Save', 'fi:Cancel'])
+        self.assertEqual(translate(dict(save=labels[0], cancel='Cancel')), dict(save='fi:Save', cancel='fi:Cancel'))
+        self.assertEqual(self.context.translator.calls, 3)
+
+
+class TestMMapCatalog(TestCase):
+    localedir = os.path.join(os.path.dirname(__file__), 'locale')
+
+    def load(self, cls, language='fi'):
+        with open(os.path.join(self.localedir, language, 'LC_MESSAGES', 'messages.mo'), 'rb') as fp:
+            return cls(fp)
+
+    def test_equivalent(self):
+        for language in ('fi', 'en'):
+            expected, catalog = self.load(GNUTranslations, language), self.load(MMapTranslations, language)
+
+            self.assertEqual(catalog.charset(), expected.charset())
+            self.assertEqual(catalog.info(), expected.info())
+
+            for key, value in expected._catalog.items():
+                self.assertEqual(catalog._catalog[key], value)
+
+    def test_lookup(self):
+        catalog = self.load(MMapTranslations)
+
+        self.assertEqual(catalog.ugettext('This works!'), 'Tämä toimii!')
+        self.assertEqual(catalog.gettext(b'This works!'), 'Tämä toimii!'.encode('utf-8'))
+        self.assertEqual(catalog.ungettext('Singular works!', 'Plural works!', 1), 'Yksikkö toimii!')
+        self.assertEqual(catalog.ungettext('Singular works!', 'Plural works!', 5), 'Monikko toimii!')
+        self.assertEqual(catalog.ugettext('Singular works!'), 'Singular works!')
+        self.assertEqual(catalog.ugettext('Missing'), 'Missing')
+        self.assertEqual(catalog.ugettext('Tämä'), 'Tämä')
+
+    def test_fallback(self):
+        catalog = translation('messages', self.localedir, languages=['de', 'fi', 'en'], class_=MMapTranslations)
+
+        assert isinstance(catalog, MMapTranslations)
+        self.assertEqual(catalog.ugettext('This works!'), 'Tämä toimii!')
+
+    def test_search(self):
+        messages = sorted((('message %03d' % i).encode('ascii'), ('translation %d' % i).encode('ascii')) for i in range(100))
+        originals, translations = b'', b''
+        offset = 28 + len(messages) * 16
+        tables = [[], []]
+
+        for message, translated in messages:
+            tables[0].append(struct.pack(b'<II', len(message), offset + len(originals)))
+            originals += message + b'\x00'
+
+        offset += len(originals)
+
+        for message, translated in messages:
+            tables[1].append(struct.pack(b'<II', len(translated), offset + len(translations)))
+            translations += translated + b'\x00'
+
+        header = struct.pack(b'<7I', 0x950412de, 0, len(messages), 28, 28 + len(messages) * 8, 0, 0)
+
+        with tempfile.TemporaryFile() as fp:
+            fp.write(header + b''.join(tables[0]) + b''.join(tables[1]) + originals + translations)
+            fp.seek(0)
+            catalog = MMapTranslations(fp)
+
+        for i in range(100):
+            self.assertEqual(catalog.gettext(b'message %03d' % i), b'translation %d' % i)
+
+        self.assertEqual(catalog.gettext(b'message 100'), b'message 100')
+        self.assertEqual(catalog.gettext(b'aaa'), b'aaa')
@@ -24,11 +24,26 @@ class Hello(HTTPMethod):
         return "Hello %s!" % (self.name, )
 
 
+class Stream(HTTPMethod):
+    consumed = False
+    
+    def get(self):
+        def body():
+            Stream.consumed = True
+            yield "streamed"
+        
+        return body()
+    
+    def put(self):
+        return "put"
+
+
 class RootController(PlainController):
     def detect(self):
         return web.core.request.method
     
     test = Hello()
+    stream = Stream()
 
 
 test_config = {'debug': True, 'web.widgets': False, 'web.sessions': False, 'web.compress': False, 'web.static': False}
@@ -65,6 +80,21 @@ class TestRESTfulDispatch(WebTestCase):
         head = self.assertResponse('/test/', _method="HEAD", body="")
         self.assertEqual(head.content_length, 17)
     
+    def test_head_stream(self):
+        self.assertResponse('/stream/', _method="HEAD", body="")
+        self.assertFalse(Stream.consumed)
+        
+        self.assertResponse('/stream/', body="streamed")
+        self.assertTrue(Stream.consumed)
+    
+    def test_verbs(self):
+        self.assertEqual(Hello.__verbs__, ('GET', 'POST', 'HEAD', 'OPTIONS'))
+        self.assertEqual(Stream.__allow__, 'GET, PUT, HEAD, OPTIONS')
+        self.assertEqual(RootController.test.methods, ['GET', 'POST', 'HEAD', 'OPTIONS'])
+        
+        response = self.assertResponse('/stream/', '405 Method Not Allowed', 'text/plain', 'POST')
+        self.assertEqual(response.headers['Allow'], 'GET, PUT, HEAD, OPTIONS')
+    
     def test_override(self):
         head = self.assertResponse('/test/?_verb=HEAD', body="")
         self.assertEqual(head.content_length, 17)
@@ -5,7 +5,7 @@ import pyamf.remoting
 
 from webob import Request
 
-from web.core import Application
+from web.core import Application, Controller
 from web.rpc.amf import AMFController
 from common import WebTestCase
 
@@ -37,6 +37,34 @@ class RootController(AMFController):
         return result
 
 
+class MathController(AMFController):
+    def add(self, a, b):
+        return a + b
+
+
+class EagerController(AMFController):
+    __eager__ = True
+
+    math = MathController()
+
+    def test(self):
+        return "ok"
+
+    def _private(self):
+        return "private"
+
+
+class ConstructedController(AMFController):
+    __eager__ = True
+
+    def __init__(self):
+        super(ConstructedController, self).__init__()
+        self.math = MathController()
+
+    def test(self):
+        return "ok"
+
+
 class TestAMFRPC(WebTestCase):
     root = RootController()
     app = Application.factory(root=root, **test_config)
@@ -69,6 +97,13 @@ class TestAMFRPC(WebTestCase):
         response, data = self.assertRPCResponse('test')
         self.assertEquals(data.body, 'ok')
 
+    def test_processor_cache(self):
+        self.assertRPCResponse('test')
+        processor = self.root._processors[False]
+
+        self.assertRPCResponse('add', [1, 2])
+        self.assertTrue(self.root._processors[False] is processor)
+
     def test_bad_method(self):
         response, data = self.assertRPCResponse('add')
         self.assertEquals(data.body.code, "TypeError")
@@ -110,3 +145,47 @@ class TestAMFRPC(WebTestCase):
     def test_after(self):
         response, data = self.assertRPCResponse('add', [2, 4])
         self.assertEquals(self.root.result, 6)
+
+
+class TestEagerAMFRPC(WebTestCase):
+    root = EagerController()
+    app = Application.factory(root=root, **test_config)
+
+    assertRPCResponse = TestAMFRPC.__dict__['assertRPCResponse']
+
+    def test_registered(self):
+        self.assertEqual(sorted(self.root._gateway.services), ['math.add', 'test'])
+
+    def test_nested(self):
+        response, data = self.assertRPCResponse('math.add', [27, 42])
+        self.assertEquals(data.body, 69)
+
+    def test_private(self):
+        self.assertRPCResponse('_private', status='501 Not Implemented', content_type='text/plain')
+
+
+class TestConstructedAMFRPC(WebTestCase):
+    root = ConstructedController()
+    app = Application.factory(root=root, **test_config)
+
+    assertRPCResponse = TestAMFRPC.__dict__['assertRPCResponse']
+
+    def test_registered(self):
+        self.assertEqual(sorted(self.root._gateway.services), ['math.add', 'test'])
+
+
+
+class NestedController(Controller):
+    amf = ConstructedController()
+
+
+class TestNestedAMFRPC(WebTestCase):
+    app = Application.factory(root=NestedController, **test_config)
+
+    assertRPCResponse = TestAMFRPC.__dict__['assertRPCResponse']
+
+    def test_registered(self):
+        self.assertEqual(NestedController.amf._gateway.services, dict())
+
+        self.assertRPCResponse('test', path='/amf')
+        self.assertEqual(sorted(NestedController.amf._gateway.services), ['math.add', 'test'])
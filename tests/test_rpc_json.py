@@ -1,11 +1,17 @@
 # encoding: utf-8
 
 import web
+import time
+import threading
 
 from unittest import TestCase
 from webob import Request, Response
+from paste.registry import StackedObjectProxy
 from web.core import Application
+from web.core.context import ContextProxy
+from web.rpc import jsonrpc
 from web.rpc.jsonrpc import JSONRPCController
+from web.utils import codec
 from common import WebTestCase
 
 try:
@@ -23,6 +29,38 @@ class RootController(JSONRPCController):
     
     def add(self, a, b):
         return a + b
+    
+    def fail(self):
+        raise ValueError("failed")
+    
+    def path(self):
+        return web.core.request.path_info
+
+
+stacked = StackedObjectProxy(name="stacked")
+lazy = ContextProxy('built')
+
+
+class BatchController(JSONRPCController):
+    def __call__(self, request):
+        request.environ['paste.registry'].register(stacked, "registered")
+        web.core.context.current().lazy('built', lambda: time.sleep(0.01) or "built")
+        return super(BatchController, self).__call__(request)
+    
+    def add(self, a, b):
+        return a + b
+    
+    def path(self):
+        return web.core.request.path_info
+    
+    def stacked(self):
+        return stacked.upper()
+    
+    def lazy(self):
+        return lazy.upper()
+    
+    def thread(self):
+        return threading.current_thread().name
 
 
 class TestJSONRPC(WebTestCase):
@@ -96,3 +134,152 @@ class TestJSONRPC(WebTestCase):
         response = request.get_response(self.app)
         self.assertEqual((response.status, response.content_type), ('200 OK', 'application/json'))
         self.assertEqual((response.content_length, response.body), (0, ''))
+    
+    
+    def assertBatchResponse(self, calls, status='200 OK', content_type='application/json'):
+        request = Request.blank('/', method="POST", body=dumps(calls))
+        response = request.get_response(self.app)
+        
+        self.assertEqual((response.status, response.content_type), (status, content_type))
+        
+        return response, loads(response.body) if response.body else None
+    
+    def test_batch(self):
+        response, data = self.assertBatchResponse([
+                dict(jsonrpc="2.0", method="add", params=[1, 2], id=1),
+                dict(jsonrpc="2.0", method="test", id="two"),
+                dict(jsonrpc="2.0", method="add", params=dict(a=2, b=3), id=3),
+                dict(jsonrpc="2.0", method="path", id=4)
+            ])
+        
+        self.assertEqual(data, [
+                dict(jsonrpc="2.0", result=3, id=1),
+                dict(jsonrpc="2.0", result="ok", id="two"),
+                dict(jsonrpc="2.0", result=5, id=3),
+                dict(jsonrpc="2.0", result="/", id=4)
+            ])
+    
+    def test_batch_notifications(self):
+        response, data = self.assertBatchResponse([
+                dict(jsonrpc="2.0", method="test"),
+                dict(jsonrpc="2.0", method="add", params=[1, 2], id=1),
+                dict(jsonrpc="2.0", method="missing")
+            ])
+        
+        self.assertEqual(data, [dict(jsonrpc="2.0", result=3, id=1)])
+        
+        response, data = self.assertBatchResponse([dict(jsonrpc="2.0", method="test")])
+        self.assertEqual((response.content_length, data), (0, None))
+    
+    def test_batch_errors(self):
+        response, data = self.assertBatchResponse([
+                dict(jsonrpc="2.0", method="missing", id=1),
+                dict(jsonrpc="2.0", method="_private", id=2),
+                dict(jsonrpc="2.0", method="add", params=[1], id=3),
+                dict(jsonrpc="2.0", method="add", params=dict(a=1, c=2), id=4),
+                dict(jsonrpc="2.0", method="fail", id=5),
+                dict(jsonrpc="2.0", method="add", params="foo", id=6),
+                1
+            ])
+        
+        self.assertEqual([i['error']['code'] for i in data], [-32601, -32601, -32602, -32602, -32000, -32600, -32600])
+        self.assertEqual([i['id'] for i in data], [1, 2, 3, 4, 5, 6, None])
+        self.assertEqual(data[4]['error']['message'], "failed")
+    
+    def test_batch_empty(self):
+        response, data = self.assertBatchResponse([])
+        self.assertEqual(data['error']['code'], -32600)
+
+
+class TestParallelBatch(WebTestCase):
+    app = Application.factory(root=BatchController, **dict(test_config, **{'web.rpc.json.threads': 4}))
+    
+    def test_parallel(self):
+        calls = [dict(jsonrpc="2.0", method="add", params=[i, i], id=i) for i in range(20)]
+        calls.append(dict(jsonrpc="2.0", method="path", id="path"))
+        
+        request = Request.blank('/', method="POST", body=dumps(calls))
+        response = request.get_response(self.app)
+        data = loads(response.body)
+        
+        self.assertEqual([i['result'] for i in data], [i * 2 for i in range(20)] + ["/"])
+        self.assertEqual([i['id'] for i in data], range(20) + ["path"])
+    
+    def test_registered(self):
+        calls = [dict(jsonrpc="2.0", method="stacked", id=i) for i in range(8)]
+        
+        request = Request.blank('/', method="POST", body=dumps(calls))
+        response = request.get_response(self.app)
+        
+        self.assertEqual([i['result'] for i in loads(response.body)], ["REGISTERED"] * 8)
+    
+    def test_lazy(self):
+        calls = [dict(jsonrpc="2.0", method="lazy", id=i) for i in range(8)]
+        
+        request = Request.blank('/', method="POST", body=dumps(calls))
+        response = request.get_response(self.app)
+        
+        self.assertEqual([i.get('result') for i in loads(response.body)], ["BUILT"] * 8)
+    
+    def test_database_session(self):
+        calls = [dict(jsonrpc="2.0", method="thread", id=i) for i in range(8)]
+        
+        request = Request.blank('/', method="POST", body=dumps(calls))
+        request.environ['web.db.sessions'] = 0
+        response = request.get_response(self.app)
+        
+        self.assertEqual([i['result'] for i in loads(response.body)], [threading.current_thread().name] * 8)
+    
+    def test_pool_size(self):
+        self.assertEqual(jsonrpc.pool()._processes, 4)
+        
+        config, web.core.config = web.core.config, dict(web.core.config, **{'web.rpc.json.threads': 2})
+        
+        try:
+            self.assertEqual(jsonrpc.pool()._processes, 2)
+        finally:
+            web.core.config = config
+
+
+
+class CountingCodec(object):
+    def __init__(self):
+        self.calls = []
+    
+    def loads(self, data, **kw):
+        self.calls.append('loads')
+        return loads(data, **kw)
+    
+    def load(self, fp, **kw):
+        self.calls.append('load')
+        return loads(fp.read(), **kw)
+    
+    def dumps(self, obj, **kw):
+        self.calls.append('dumps')
+        return dumps(obj, **kw)
+
+
+class TestCodec(WebTestCase):
+    app = TestJSONRPC.app
+    
+    def setUp(self):
+        self.codec = CountingCodec()
+        codec.register('counting', self.codec)
+        self.previous = codec.current()
+        codec.use('counting')
+    
+    def tearDown(self):
+        codec.codecs.pop('counting')
+        codec.use(self.previous.name)
+    
+    def test_registry(self):
+        self.assertEqual(codec.current().name, 'counting')
+        self.assertEqual(codec.loads(codec.dumps([1, "two"])), [1, "two"])
+        self.assertEqual(codec.use('json').dumps, __import__('json').dumps)
+    
+    def test_rpc(self):
+        request = Request.blank('/', method="POST", body=dumps(dict(method="add", params=[27, 42], id=1)))
+        response = request.get_response(self.app)
+        
+        self.assertEqual(loads(response.body)['result'], 69)
+        self.assertEqual(self.codec.calls, ['load', 'dumps'])
@@ -4,7 +4,7 @@ from unittest import TestCase
 from nose.tools import raises
 
 from web.core import Dialect
-from web.rpc import route, RoutingError
+from web.rpc import route, resolve, invalidate, Routable, RoutingError
 
 
 
@@ -24,6 +24,19 @@ Foo.deep = Foo()
 Foo.deep2 = Dialect()
 
 
+class Bar(Routable, Dialect):
+    def normal(self, a, b=None):
+        return 1
+
+
+class Baz(Dialect):
+    current = None
+    
+    @property
+    def child(self):
+        return self.current
+
+
 class TestRPCRouting(TestCase):
     def test_basic(self):
         self.assertEqual(route(Foo, 'normal', Dialect)[0], Foo.normal)
@@ -58,5 +71,66 @@ class TestRPCRouting(TestCase):
     @raises(RoutingError)
     def test_early_terminate(self):
         route(Foo, 'normal.foo', Dialect)
-
-
+    
+    def test_cached(self):
+        root = Foo()
+        entry = resolve(root, 'deep.normal', Dialect)
+        
+        self.assertTrue(resolve(root, 'deep.normal', Dialect) is entry)
+        self.assertEqual(list(entry), [Foo.deep.normal, Foo.deep])
+        self.assertEqual(route(root, 'deep.normal', Dialect), (Foo.deep.normal, Foo.deep))
+        
+        invalidate()
+        self.assertFalse(resolve(root, 'deep.normal', Dialect) is entry)
+    
+    def test_argspec(self):
+        entry = resolve(Bar(), 'normal', Dialect)
+        self.assertEqual(entry.argspec[:3], (['a', 'b'], dict(b=None), False))
+    
+    def test_invalidation(self):
+        root = Bar()
+        self.assertEqual(root.normal(None), 1)
+        self.assertEqual(route(root, 'normal', Dialect)[0](None), 1)
+        
+        root.normal = lambda a: 2
+        self.assertEqual(route(root, 'normal', Dialect)[0](None), 2)
+        
+        del root.normal
+        self.assertEqual(route(root, 'normal', Dialect)[0](None), 1)
+    
+    def test_state(self):
+        root = Bar()
+        entry = resolve(root, 'normal', Dialect)
+        
+        root.counter = 1
+        self.assertTrue(resolve(root, 'normal', Dialect) is entry)
+    
+    def test_scoped(self):
+        root, other = Bar(), Bar()
+        entry = resolve(root, 'normal', Dialect)
+        
+        other.normal = lambda a: 2
+        self.assertTrue(resolve(root, 'normal', Dialect) is entry)
+        
+        invalidate(root)
+        self.assertFalse(resolve(root, 'normal', Dialect) is entry)
+    
+    def test_nested(self):
+        root = Bar()
+        root.child = Bar()
+        entry = resolve(root, 'child.normal', Dialect)
+        
+        root.child.normal = lambda a: 2
+        self.assertEqual(resolve(root, 'child.normal', Dialect).callable(None), 2)
+    
+    def test_property(self):
+        root = Baz()
+        
+        root.current = Bar()
+        first = resolve(root, 'child.normal', Dialect)
+        
+        root.current = Bar()
+        second = resolve(root, 'child.normal', Dialect)
+        
+        self.assertTrue(second.parent is root.current)
+        self.assertFalse(first is second)
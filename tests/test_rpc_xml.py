@@ -2,6 +2,7 @@
 
 import xmlrpclib
 
+from StringIO import StringIO
 from webob import Request
 
 from web.core import Application
@@ -36,6 +37,15 @@ class RootController(XMLRPCController):
         return result
 
 
+class StreamingController(XMLRPCController):
+    __max_body_length__ = 1024
+    __max_depth__ = 3
+    __chunk_size__ = 16
+
+    def echo(self, value):
+        return value
+
+
 class TestXMLRPC(WebTestCase):
     root = RootController()
     app = Application.factory(root=root, **test_config)
@@ -117,3 +127,41 @@ class TestXMLRPC(WebTestCase):
     def test_after(self):
         response, data = self.assertRPCResponse('add', [2, 4])
         self.assertEquals(self.root.result, 6)
+
+
+class TestStreamingXMLRPC(WebTestCase):
+    app = Application.factory(root=StreamingController, **test_config)
+
+    def call(self, body):
+        request = Request.blank('/', method="POST", body=body)
+        return request.get_response(self.app)
+
+    def test_chunked(self):
+        value = dict(name="x" * 100, items=[1, 2, [3, 4]])
+        response = self.call(xmlrpclib.dumps((value, ), 'echo'))
+        self.assertEqual(xmlrpclib.loads(response.body), ((value, ), None))
+
+    def test_depth(self):
+        response = self.call(xmlrpclib.dumps(([[[[1]]]], ), 'echo'))
+
+        with self.assertRaises(xmlrpclib.Fault) as cm:
+            xmlrpclib.loads(response.body)
+
+        self.assertEqual(cm.exception.faultCode, -32600)
+
+    def test_terminated(self):
+        body = xmlrpclib.dumps(("ok", ), 'echo')
+        request = Request.blank('/', method="POST", body=body)
+        del request.environ['CONTENT_LENGTH']
+        request.environ['wsgi.input_terminated'] = True
+
+        response = request.get_response(self.app)
+        self.assertEqual(xmlrpclib.loads(response.body), (("ok", ), None))
+
+    def test_terminated_too_large(self):
+        request = Request.blank('/', method="POST")
+        request.environ.update({'wsgi.input': StringIO(xmlrpclib.dumps(("x" * 2048, ), 'echo')), 'wsgi.input_terminated': True})
+        request.environ.pop('CONTENT_LENGTH', None)
+
+        response = request.get_response(self.app)
+        self.assertEqual((response.status, response.content_type), ('413 Request Entity Too Large', "text/plain"))
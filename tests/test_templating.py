@@ -1,15 +1,27 @@
 # encoding: utf-8
 
+import os
+import shutil
+import tempfile
+
 from unittest import TestCase
 
 from webob import Request
 from nose.tools import raises, eq_
+from paste.registry import StackedObjectProxy
+
+import web.core
 
 from web.core import Application, Controller
+from web.core.context import Context, activate
 from web.core.templating import template
 from web.core import templating
 
 
+calls = []
+stacked = StackedObjectProxy(name="stacked")
+
+
 class RootController(Controller):
     @template('templates.test')
     def decorator(self):
@@ -42,6 +54,28 @@ class RootController(Controller):
     
     def relative(self):
         return 'templates.relativetest', dict()
+    
+    @template('templates.registry', cache_key=lambda self, var1, var2=0: var1, cache_tags=('numbers', ))
+    def cached(self, var1, var2=0):
+        calls.append(var1)
+        return dict(var1=var1, var2=var2)
+    
+    @template('templates.test', cache_key='static')
+    def cached_simple(self, value=None):
+        return value
+    
+    def streamed(self):
+        return 'templates.stream', dict(items=range(3)), dict(stream=True)
+    
+    def jsonp(self):
+        return 'json:', dict(hello="world"), dict(content_type='text/javascript', i18n=None)
+    
+    def streamed_registered(self):
+        web.core.request.environ['paste.registry'].register(stacked, [u'a', u'b'])
+        return 'templates.stream', dict(items=(stacked[i] for i in range(2))), dict(stream=True)
+    
+    def streamed_mako(self):
+        return 'mako:templates.unicode_mako', dict(), dict(stream=True)
 
 
 test_config = {'debug': True, 'web.widgets': False, 'web.sessions': False, 'web.compress': False, 'web.static': False}
@@ -105,6 +139,13 @@ class TestTemplates(TestCase):
         eq_(response.charset, "UTF-8")
         eq_(response.unicode_body, u'<html><body><h1>© 2009</h1></body></html>')
 
+    def test_json_options(self):
+        response = Request.blank('/jsonp').get_response(self.app)
+
+        eq_(response.status, "200 OK")
+        eq_(response.content_type, "text/javascript")
+        eq_(response.body, '{"hello": "world"}')
+
     def test_template_globals(self):
         response = Request.blank('/variables').get_response(self.app)
 
@@ -132,3 +173,293 @@ class TestTemplates(TestCase):
         environ = {'web.translator': lambda x: x.swapcase()}
         response = Request.blank('/tuple', environ=environ).get_response(self.app)
         eq_(response.body, '<html xmlns="http://www.w3.org/1999/xhtml"><body><h1>It works!</h1></body></html>')
+
+
+class TestStreaming(TestCase):
+    app = TestTemplates.app
+    streaming = Application.factory(root=RootController, **dict(test_config, **{'web.templating.stream': True}))
+    
+    def test_stream(self):
+        response = Request.blank('/streamed').get_response(self.app)
+        
+        eq_(response.status, "200 OK")
+        eq_(response.content_type, "text/html")
+        eq_(response.content_length, None)
+        eq_(response.body, '<html xmlns="http://www.w3.org/1999/xhtml"><body><p>0</p><p>1</p><p>2</p>/streamed</body></html>')
+    
+    def test_registered(self):
+        response = Request.blank('/streamed_registered').get_response(self.app)
+        
+        eq_(response.status, "200 OK")
+        eq_(response.body, '<html xmlns="http://www.w3.org/1999/xhtml"><body><p>a</p><p>b</p>/streamed_registered</body></html>')
+    
+    def test_fallback(self):
+        response = Request.blank('/streamed_mako').get_response(self.app)
+        
+        eq_(response.status, "200 OK")
+        eq_(response.unicode_body, u'<html><body><h1>\xa9 2009</h1></body></html>')
+    
+    def test_configured(self):
+        response = Request.blank('/tuple').get_response(self.streaming)
+        
+        eq_(response.content_length, None)
+        eq_(response.body, '<html xmlns="http://www.w3.org/1999/xhtml"><body><h1>It works!</h1></body></html>')
+    
+    def test_chunked(self):
+        chunks = list(templating._chunked([u'a' * 10, u'\xa9' * 5, 'b' * 20, u'c'], 'utf-8', 15))
+        eq_(chunks, ['a' * 10 + '\xc2\xa9' * 5, 'b' * 20, 'c'])
+
+
+class TestFragments(TestCase):
+    app = TestTemplates.app
+    
+    def setUp(self):
+        self.fragments = templating.fragments
+        templating.fragments = templating.MemoryFragments()
+    
+    def tearDown(self):
+        templating.fragments = self.fragments
+    
+    def body(self, path):
+        response = Request.blank(path).get_response(self.app)
+        eq_(response.status, "200 OK")
+        return response.body
+    
+    def test_decorator(self):
+        del calls[:]
+        
+        eq_(self.body('/cached/1?var2=2'), '<html xmlns="http://www.w3.org/1999/xhtml"><body>1 2</body></html>')
+        eq_(self.body('/cached/1?var2=3'), '<html xmlns="http://www.w3.org/1999/xhtml"><body>1 2</body></html>')
+        eq_(self.body('/cached/2?var2=3'), '<html xmlns="http://www.w3.org/1999/xhtml"><body>2 3</body></html>')
+        eq_(calls, ['1', '2'])
+        
+        templating.invalidate('numbers')
+        eq_(self.body('/cached/1?var2=3'), '<html xmlns="http://www.w3.org/1999/xhtml"><body>1 3</body></html>')
+        eq_(calls, ['1', '2', '1'])
+    
+    def test_uncacheable(self):
+        eq_(self.body('/cached_simple?value=one'), 'one')
+        eq_(self.body('/cached_simple?value=two'), 'two')
+        eq_(len(templating.fragments.cache), 0)
+    
+    def test_render(self):
+        first = templating.render('genshi:templates.registry', dict(var1=1, var2=2), cache_key='render', cache_tags=('a', 'b'))
+        eq_(templating.render('genshi:templates.registry', dict(var1=3, var2=4), cache_key='render', cache_tags=('a', 'b')), first)
+        
+        templating.invalidate('b')
+        assert templating.render('genshi:templates.registry', dict(var1=3, var2=4), cache_key='render', cache_tags=('a', 'b')) != first
+    
+    def test_expiry(self):
+        templating.render('genshi:templates.registry', dict(var1=1, var2=2), cache_key='expiry', cache_ttl=-1)
+        eq_(len(templating.fragments.cache), 1)
+        
+        second = templating.render('genshi:templates.registry', dict(var1=3, var2=4), cache_key='expiry')
+        assert '3 4' in second[1]
+    
+    def test_tags(self):
+        templating.fragments = templating.MemoryFragments(2)
+        first = templating.fragments.tag('first')
+        
+        for i in range(10):
+            templating.fragments.tag(i)
+        
+        eq_(len(templating.fragments.tags), 2)
+        assert templating.fragments.tag('first') != first
+
+
+class TestBeakerFragments(TestCase):
+    def setUp(self):
+        from beaker.cache import CacheManager
+        
+        self.previous = activate(Context())
+        web.core.cache._push_object(CacheManager(type='memory'))
+        self.fragments = templating.fragments
+        templating.fragments = templating.BeakerFragments()
+    
+    def tearDown(self):
+        templating.fragments = self.fragments
+        activate(self.previous)
+    
+    def test_cached(self):
+        first = templating.render('genshi:templates.registry', dict(var1=1, var2=2), cache_key='beaker', cache_tags=('a', ))
+        eq_(templating.render('genshi:templates.registry', dict(var1=3, var2=4), cache_key='beaker', cache_tags=('a', )), first)
+        
+        templating.invalidate('a')
+        assert '3 4' in templating.render('genshi:templates.registry', dict(var1=3, var2=4), cache_key='beaker', cache_tags=('a', ))[1]
+    
+    def test_unavailable(self):
+        activate(Context())
+        eq_(templating.fragments.get('missing'), None)
+        templating.fragments.set('missing', 'value')
+
+
+class TestNamespace(TestCase):
+    def setUp(self):
+        self.registry = list(templating.registry)
+    
+    def tearDown(self):
+        templating.registry[:] = self.registry
+        templating.refresh()
+    
+    def variables(self):
+        content_type, output = templating.render('genshi:templates.registry', dict())
+        return output[output.index('<body>') + 6:output.index('</body>')]
+    
+    def test_static(self):
+        static = dict(var1=1, var2=2)
+        templating.registry.append(static)
+        eq_(self.variables(), u'1 2')
+        
+        static['var1'] = 3
+        eq_(self.variables(), u'1 2')
+        
+        templating.refresh()
+        eq_(self.variables(), u'3 2')
+    
+    def test_dynamic(self):
+        counter = []
+        
+        def provider():
+            counter.append(1)
+            return dict(var1=len(counter))
+        
+        templating.registry.extend([provider, dict(var2=2)])
+        eq_(self.variables(), u'1 2')
+        eq_(self.variables(), u'2 2')
+    
+    def test_order(self):
+        templating.registry.extend([dict(var1=1, var2=1), lambda: dict(var1=2, var2=2), dict(var2=3)])
+        eq_(self.variables(), u'2 3')
+        
+        templating.registry.pop()
+        eq_(self.variables(), u'2 2')
+    
+    def test_plain(self):
+        registry, templating.registry = templating.registry, list(templating.registry)
+        
+        try:
+            templating.registry.append(dict(var1=6, var2=6))
+            eq_(self.variables(), u'6 6')
+            
+            templating.registry.append(dict(var2=7))
+            eq_(self.variables(), u'6 7')
+        
+        finally:
+            templating.registry = registry
+    
+    def test_generation(self):
+        generation = templating.registry.generation
+        
+        templating.registry[len(templating.registry):] = [dict(var1=4, var2=4)]
+        eq_(self.variables(), u'4 4')
+        
+        templating.registry.insert(len(templating.registry), dict(var2=5))
+        eq_(self.variables(), u'4 5')
+        
+        eq_(templating.registry.generation, generation + 2)
+
+
+
+class TestResolver(TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.filename = os.path.join(self.path, 'page.html')
+        
+        with open(self.filename, 'w') as fh:
+            fh.write('<html/>')
+    
+    def tearDown(self):
+        shutil.rmtree(self.path)
+    
+    def test_cached(self):
+        resolver = templating.TemplateResolver('genshi')
+        first = resolver('templates.test')
+        
+        eq_(first, ('genshi', os.path.join(os.path.dirname(__file__), 'templates', 'test.html')))
+        assert resolver('templates.test') is first
+        
+        resolver.default = 'mako'
+        eq_(resolver('templates.test')[0], 'mako')
+        eq_(resolver('json:'), ('json', None))
+    
+    def test_permanent(self):
+        resolver = templating.TemplateResolver('genshi')
+        result = resolver(self.filename)
+        
+        os.unlink(self.filename)
+        assert resolver(self.filename) is result
+    
+    def test_revalidate(self):
+        resolver = templating.TemplateResolver('genshi', revalidate=True)
+        result = resolver(self.filename)
+        assert resolver(self.filename) is result
+        
+        os.utime(self.filename, (0, 0))
+        assert resolver(self.filename) is not result
+        eq_(resolver(self.filename), result)
+
+
+class TestPrecompile(TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.genshi = os.path.join(self.path, 'page.html')
+        self.mako = os.path.join(self.path, 'page.mako')
+        
+        with open(self.genshi, 'w') as fh:
+            fh.write('<html><body>${name}</body></html>')
+        
+        with open(self.mako, 'w') as fh:
+            fh.write('<html><body>${name}</body></html>')
+        
+        with open(os.path.join(self.path, 'broken.html'), 'w') as fh:
+            fh.write('<html><body>')
+        
+        with open(os.path.join(self.path, 'README'), 'w') as fh:
+            fh.write('Not a template.')
+    
+    def tearDown(self):
+        shutil.rmtree(self.path)
+    
+    def test_precompile(self):
+        eq_(templating.precompile([self.path], threads=2), (2, 1))
+        
+        assert self.genshi in templating._render['genshi'].cache
+        assert self.mako in templating._render['mako'].cache
+        assert u'Alice' in templating.render('genshi:' + self.genshi, dict(name=u'Alice'))[1]
+    
+    def test_capacity(self):
+        for i in range(40):
+            for extension in ('html', 'mako'):
+                with open(os.path.join(self.path, 'page%d.%s' % (i, extension)), 'w') as fh:
+                    fh.write('<html><body>${name}</body></html>')
+        
+        eq_(templating.precompile([self.path], threads=4), (82, 1))
+        
+        for i in range(40):
+            assert os.path.join(self.path, 'page%d.html' % (i, )) in templating._render['genshi'].cache
+            assert os.path.join(self.path, 'page%d.mako' % (i, )) in templating._render['mako'].cache
+        
+        eq_(len(templating._render['genshi'].cache[self.path]._cache), 41)
+    
+    def test_evicted(self):
+        templating.residents['mako'] = lambda engine, filename: False
+        
+        try:
+            eq_(templating.precompile([self.path], threads=1), (1, 2))
+        finally:
+            del templating.residents['mako']
+    
+    def test_exclude(self):
+        eq_(templating.precompile([self.path], threads=1, exclude=('genshi', )), (1, 0))
+    
+    def test_package(self):
+        compiled, failed = templating.precompile(['test_templating'])
+        
+        assert compiled
+        assert os.path.join(os.path.dirname(__file__), 'templates', 'subpackage', 'test.html') in templating._render['genshi'].cache
+    
+    def test_middleware(self):
+        config = dict(test_config, **{'web.templating.precompile': self.path})
+        templating.TemplatingMiddleware(None, config)
+        assert self.mako in templating._render['mako'].cache
+        eq_(templating.precompiled, ([self.path], (2, 1)))
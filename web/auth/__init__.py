@@ -4,7 +4,7 @@ import functools
 import inspect
 import web.core
 
-from paste.registry import StackedObjectProxy
+from web.core.context import ContextProxy
 from web.auth import middleware, predicates
 from web.auth.predicates import *
 
@@ -13,7 +13,7 @@ __all__ = ['config', 'user', 'authenticate', 'deauthenticate', 'authorize'] + pr
 log = __import__('logging').getLogger(__name__)
 
 config = None
-user = StackedObjectProxy(name="user")
+user = ContextProxy("user")
 
 web.core.namespace['web']['auth'] = predicates
 web.core.namespace['web']['user'] = user
@@ -43,11 +43,16 @@ def authenticate(identifier, password=None, force=False):
     web.core.session[config.name] = result[0]
     web.core.session.save()
     
+    if config.cache is not None:
+        config.cache.set(web.core.session.id, result)
+    
     web.core.request.environ['paste.registry'].register(
             user,
             result[1]
         )
     
+    predicates.reset()
+    
     return True
 
 
@@ -59,6 +64,9 @@ def deauthenticate(nuke=False):
     Additionally, this function can also completely erase the Beaker session.
     """
     
+    if config.cache is not None:
+        config.cache.invalidate(web.core.session.id)
+    
     if nuke:
         web.core.session.invalidate()
     
@@ -66,6 +74,7 @@ def deauthenticate(nuke=False):
     web.core.session.save()
     
     web.core.request.environ['paste.registry'].register(user, None)
+    predicates.reset()
 
 
 def authorize(predicate):
@@ -75,10 +84,12 @@ def authorize(predicate):
     401 Not Authorized error if you want to do this by hand.
     """
     
+    predicate = predicates.compiled(predicate)
+    
     def decorator(func):
         @functools.wraps(func)
         def wrapper(*args, **kw):
-            if not bool(predicate):
+            if not predicates.evaluate(predicate):
                 raise web.core.http.HTTPUnauthorized()
             
             return func(*args, **kw)
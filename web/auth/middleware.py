@@ -4,11 +4,12 @@ import urllib
 import web
 
 from marrow.util.bunch import Bunch
-from marrow.util.convert import boolean, array
+from marrow.util.convert import boolean, array, integer
 from marrow.util.object import load_object
+from web.utils.cache import LRUCache
 
 
-__all__ = ['WebAuth', 'BasicAuthMiddleware']
+__all__ = ['WebAuth', 'BasicAuthMiddleware', 'MemoryIdentities', 'BeakerIdentities', 'TieredIdentities']
 log = __import__('logging').getLogger(__name__)
 
 default_config = Bunch(
@@ -17,10 +18,96 @@ default_config = Bunch(
         handler = '/login',
         internal = False,
         lookup = None,
-        authenticate = None
+        authenticate = None,
+        cache = None,
+        defer = False
     )
 
 
+class MemoryIdentities(object):
+    """In-process storage for looked up users, bounded in size and optionally in age."""
+    
+    def __init__(self, capacity=1024, ttl=None):
+        self.cache = LRUCache(capacity, ttl)
+    
+    def get(self, key):
+        return self.cache.get(key)
+    
+    def set(self, key, value):
+        self.cache.set(key, value)
+    
+    def invalidate(self, key):
+        self.cache.pop(key, None)
+
+
+class BeakerIdentities(object):
+    """Storage for looked up users in the Beaker cache of the current request (web.core.cache).
+    
+    Users are shared by every process using the same Beaker cache, and so must be picklable for
+    most Beaker back-ends.  If no Beaker cache is available nothing is cached.
+    """
+    
+    def __init__(self, namespace='web.auth', ttl=None):
+        self.namespace = namespace
+        self.ttl = ttl
+    
+    def _cache(self):
+        try:
+            return web.core.cache.get_cache(self.namespace)
+        except TypeError:
+            return None
+    
+    def get(self, key):
+        cache = self._cache()
+        
+        try:
+            return cache.get(key) if cache is not None else None
+        except KeyError:
+            return None
+    
+    def set(self, key, value):
+        cache = self._cache()
+        
+        if cache is not None:
+            cache.put(key, value, **(dict(expiretime=self.ttl) if self.ttl else dict()))
+    
+    def invalidate(self, key):
+        cache = self._cache()
+        
+        if cache is not None:
+            cache.remove_value(key)
+
+
+class TieredIdentities(object):
+    """Consult several identity caches in turn, such as an in-process cache backed by Beaker.
+    
+    A value found in a later tier is copied to the earlier ones.
+    """
+    
+    def __init__(self, *tiers):
+        self.tiers = tiers
+    
+    def get(self, key):
+        for i, tier in enumerate(self.tiers):
+            value = tier.get(key)
+            
+            if value is not None:
+                for earlier in self.tiers[:i]:
+                    earlier.set(key, value)
+                
+                return value
+        
+        return None
+    
+    def set(self, key, value):
+        for tier in self.tiers:
+            tier.set(key, value)
+    
+    def invalidate(self, key):
+        for tier in self.tiers:
+            tier.invalidate(key)
+
+
 class WebAuth(object):
     def __init__(self, application, config=dict(), prefix='auth.'):
         self.application = application
@@ -34,15 +121,44 @@ class WebAuth(object):
         
         our_config.intercept = [i.strip() for i in array(our_config.intercept)]
         our_config.internal = boolean(our_config.internal)
+        our_config.defer = boolean(our_config.defer)
+        our_config.cookie = config.get('web.sessions.key', 'session')
         
         if our_config.lookup is None:
             raise Exception('You must define an authentication lookup method.')
         
         our_config.lookup = self.get_method(our_config.lookup)
         our_config.authenticate = self.get_method(our_config.authenticate)
+        our_config.cache = self.get_cache(our_config)
         
         web.auth.config = our_config
     
+    def get_cache(self, config):
+        """Returns the identity cache described by the configuration, or None if disabled.
+        
+        The cache option is a comma-separated list of tiers, each of memory, beaker, or a dot-colon
+        reference to an object providing get, set, and invalidate methods.
+        """
+        
+        if not config.cache:
+            return None
+        
+        if not isinstance(config.cache, basestring):
+            return config.cache
+        
+        ttl = integer(config.get('cache.ttl', 300)) or None
+        tiers = []
+        
+        for name in array(config.cache):
+            if name == 'memory':
+                tiers.append(MemoryIdentities(integer(config.get('cache.capacity', 1024)), ttl))
+            elif name == 'beaker':
+                tiers.append(BeakerIdentities(config.get('cache.namespace', 'web.auth'), ttl))
+            else:
+                tiers.append(load_object(name))
+        
+        return tiers[0] if len(tiers) == 1 else TieredIdentities(*tiers)
+    
     def get_method(self, string):
         """Returns a lazily-evaluated callable."""
         
@@ -78,20 +194,62 @@ class WebAuth(object):
                 urllib.quote_plus(environ['PATH_INFO'])
             )
     
+    def has_cookie(self, environ, name):
+        """Returns True if the request includes a cookie of the given name."""
+        
+        for cookie in environ.get('HTTP_COOKIE', '').split(';'):
+            if cookie.split('=', 1)[0].strip() == name:
+                return True
+        
+        return False
+    
+    def lookup(self, session, identifier):
+        """Returns the user for the given identifier, using the identity cache if enabled.
+        
+        Cached users are stored by session ID; the lookup method is only called on a miss.
+        """
+        
+        config = web.auth.config
+        cache = config.cache
+        
+        if cache is None:
+            return config.lookup(identifier)
+        
+        entry = cache.get(session.id)
+        
+        if entry is not None and entry[0] == identifier:
+            return entry[1]
+        
+        user = config.lookup(identifier)
+        cache.set(session.id, (identifier, user))
+        
+        return user
+    
     def __call__(self, environ, start_response):
         session = environ['beaker.session']
         config = web.auth.config
         
-        # We set this to None on the first request to ensure the session ID stabalizes.
-        if config.name not in session:
-            session[config.name] = None
-            session.save()
+        if config.defer:
+            # Visitors without a session cookie are anonymous; avoid loading or creating a session.
+            identifier = session.get(config.name) if self.has_cookie(environ, config.cookie) else None
+        
+        else:
+            # We set this to None on the first request to ensure the session ID stabalizes.
+            if config.name not in session:
+                session[config.name] = None
+                session.save()
+            
+            identifier = session[config.name]
         
         if environ.has_key('paste.registry'):
-            environ['paste.registry'].register(
-                    web.auth.user,
-                    config.lookup(session[config.name]) if session[config.name] else None
-                )
+            registry = environ['paste.registry']
+            
+            # The user is only looked up when first accessed.
+            if identifier and hasattr(registry, 'lazy'):
+                registry.lazy(web.auth.user, lambda: self.lookup(session, identifier))
+            
+            else:
+                registry.register(web.auth.user, self.lookup(session, identifier) if identifier else None)
         
         def our_start_response(status, headers):
             if status.split(' ', 1)[0] in config.intercept:
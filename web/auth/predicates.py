@@ -2,17 +2,77 @@
 
 import web
 
+from web.core.context import current
+
 
 __all__ = [
         'Predicate', 'CustomPredicate',
         'Not', 'All', 'Any', 'always', 'never',
         'anonymous', 'authenticated',
-        'AttrIn', 'ValueIn', 'EnvironIn'
+        'AttrIn', 'ValueIn', 'EnvironIn',
+        'evaluate', 'compiled'
     ]
 
 
+def _memo():
+    context = current()
+    
+    if context is None or context.environ is None:
+        return None
+    
+    try:
+        return context.extras['web.auth.predicates']
+    except KeyError:
+        memo = context.extras['web.auth.predicates'] = dict()
+        return memo
+
+
+def reset():
+    """Forget the predicate results remembered for the current request, e.g. after logging in."""
+    
+    memo = _memo()
+    
+    if memo:
+        memo.clear()
+
+
+def evaluate(predicate):
+    """Evaluate a predicate, remembering the result for the remainder of the current request."""
+    
+    memo = _memo()
+    
+    if memo is None:
+        return bool(predicate)
+    
+    try:
+        return memo[predicate]
+    except KeyError:
+        result = memo[predicate] = bool(predicate)
+        return result
+    except TypeError:
+        return bool(predicate)
+
+
 class Predicate(object):
+    """The base class for predicates.
+    
+    Subclasses implement _evaluate; the result is remembered for the remainder of the request.
+    Subclasses may instead override __nonzero__ to be evaluated on every use.
+    """
+    
     def __nonzero__(self):
+        memo = _memo()
+        
+        if memo is None:
+            return self._evaluate()
+        
+        try:
+            return memo[self]
+        except KeyError:
+            result = memo[self] = bool(self._evaluate())
+            return result
+    
+    def _evaluate(self):
         raise NotImplementedError('Subclasses override this method.')
 
 
@@ -27,7 +87,7 @@ class CustomPredicate(Predicate):
         super(CustomPredicate, self).__init__()
         self.conditional = conditional
     
-    def __nonzero__(self):
+    def _evaluate(self):
         return bool(self.conditional(web.auth.user, web.core.request))
 
 
@@ -41,8 +101,8 @@ class Not(Predicate):
         super(Not, self).__init__()
         self.arg = arg
     
-    def __nonzero__(self):
-        return not bool(self.arg)
+    def _evaluate(self):
+        return not evaluate(self.arg)
 
 
 class All(Predicate):
@@ -57,8 +117,8 @@ class All(Predicate):
         super(All, self).__init__()
         self.args = args
     
-    def __nonzero__(self):
-        return all(self.args)
+    def _evaluate(self):
+        return all(evaluate(i) for i in self.args)
 
 
 class Any(Predicate):
@@ -73,8 +133,8 @@ class Any(Predicate):
         super(Any, self).__init__()
         self.args = args
     
-    def __nonzero__(self):
-        return any(self.args)
+    def _evaluate(self):
+        return any(evaluate(i) for i in self.args)
 
 
 class Always(Predicate):
@@ -101,11 +161,26 @@ class Never(Predicate):
 never = Never()
 
 
+def identified():
+    """True if a user is logged in.
+    
+    If the user has not yet been looked up this performs the lookup; an identifier in the session
+    whose user no longer exists is not enough.
+    """
+    
+    user = web.auth.user
+    
+    if user is None:
+        return False
+    
+    return user._current_obj() is not None
+
+
 class Anonymous(Predicate):
     """True if no user is currently logged in."""
     
-    def __nonzero__(self):
-        return web.auth.user is None or web.auth.user._current_obj() is None
+    def _evaluate(self):
+        return not identified()
 
 anonymous = Anonymous()
 
@@ -113,13 +188,32 @@ anonymous = Anonymous()
 class Authenticated(Predicate):
     """True if a user is currently logged in."""
     
-    def __nonzero__(self):
-        return web.auth.user is not None and web.auth.user._current_obj() is not None
+    def _evaluate(self):
+        return identified()
 
 authenticated = Authenticated()
 
 
 
+def _values(values):
+    """Prepare the values of a membership predicate as a frozenset, if they are hashable."""
+    
+    values = values if isinstance(values, (list, set, frozenset)) else [values]
+    
+    try:
+        return frozenset(values)
+    except TypeError:
+        return list(values)
+
+
+def _contains(values, value):
+    try:
+        return value in values
+    except TypeError:
+        # Unhashable values can not be members of a frozenset.
+        return False
+
+
 class AttrIn(Predicate):
     """True if the an attribute matches an element in an iterable.
     
@@ -132,10 +226,10 @@ class AttrIn(Predicate):
     def __init__(self, attr, values=[]):
         super(AttrIn, self).__init__()
         self.attr = attr
-        self.values = values if isinstance(values, list) else [values]
+        self.values = _values(values)
     
-    def __nonzero__(self):
-        return getattr(web.auth.user, self.attr, None) in self.values
+    def _evaluate(self):
+        return _contains(self.values, getattr(web.auth.user, self.attr, None))
     
     @classmethod
     def partial(cls, attr):
@@ -162,7 +256,7 @@ class ValueIn(Predicate):
         self.value = value
         self.attr = attr
     
-    def __nonzero__(self):
+    def _evaluate(self):
         return self.value in getattr(web.auth.user, self.attr, [])
     
     @classmethod
@@ -187,10 +281,10 @@ class EnvironIn(Predicate):
     def __init__(self, key, values=[]):
         super(EnvironIn, self).__init__()
         self.key = key
-        self.values = values if isinstance(values, list) else [values]
+        self.values = _values(values)
     
-    def __nonzero__(self):
-        return web.core.request.environ.get(self.key, None) in self.values
+    def _evaluate(self):
+        return _contains(self.values, web.core.request.environ.get(self.key, None))
     
     @classmethod
     def partial(cls, attr):
@@ -200,3 +294,63 @@ class EnvironIn(Predicate):
                 super(PartialEnvironIn, self).__init__(attr, values)
         
         return PartialEnvironIn
+
+
+def compiled(predicate):
+    """Simplify a predicate ahead of its evaluation.
+    
+    Nested All and Any predicates are flattened, the constant always and never predicates are
+    removed or short-circuit their parent, and double negation is eliminated.  The result is
+    equivalent to the original predicate.
+    
+    Subclasses of All, Any, and Not are returned unchanged, as they may not be reconstructed from
+    their arguments; predicates are only rebuilt if one of their arguments was simplified.
+    """
+    
+    kind = type(predicate)
+    
+    if kind is Not:
+        arg = compiled(predicate.arg)
+        
+        if arg is always:
+            return never
+        
+        if arg is never:
+            return always
+        
+        if type(arg) is Not:
+            return arg.arg
+        
+        return predicate if arg is predicate.arg else Not(arg)
+    
+    if kind not in (All, Any):
+        return predicate
+    
+    identity, absorbing = (always, never) if kind is All else (never, always)
+    args = []
+    
+    for arg in predicate.args:
+        arg = compiled(arg)
+        
+        if arg is absorbing:
+            return absorbing
+        
+        if arg is identity:
+            continue
+        
+        if type(arg) is kind:
+            args.extend(arg.args)
+            continue
+        
+        args.append(arg)
+    
+    if not args:
+        return identity
+    
+    if len(args) == 1:
+        return args[0]
+    
+    if len(args) == len(predicate.args) and all(i is j for i, j in zip(args, predicate.args)):
+        return predicate
+    
+    return kind(*args)
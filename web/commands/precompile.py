@@ -0,0 +1,78 @@
+# encoding: utf-8
+
+import os
+import sys
+
+import web.core
+
+from paste.deploy import loadapp
+from paste.script.command import Command, BadCommand
+
+from web.core import templating
+
+
+__all__ = ['PrecompileCommand']
+
+
+class PrecompileCommand(Command):
+    """Load and compile all templates of the web app, reporting any errors.
+    
+    The optional CONFIG_FILE argument specifies the config file to use.  CONFIG_FILE defaults to 'development.ini'.
+    
+    Templates are found in the templates directory of the root controller's package; additional PACKAGE arguments may be given to search other packages instead.  This is useful to check every template for syntax errors before deployment, and to populate on-disk template caches, such as Mako's module_directory.
+    
+    Example::
+    
+        $ paster precompile production.ini myapp myapp.admin
+    
+    """
+    summary = __doc__.splitlines()[0]
+    usage = 'CONFIG_FILE [PACKAGE ...]\n' + __doc__
+    
+    min_args = 0
+    group_name = 'webcore'
+    
+    parser = Command.standard_parser()
+    parser.add_option('-t', '--threads', type='int', dest='threads', default=4, help="The number of threads to compile templates with (default 4)")
+    parser.add_option('-q', action='count', dest='quiet', default=0, help="Do not load logging configuration from the config file")
+    
+    def command(self):
+        config_file = self.args[0] if self.args else 'development.ini'
+        
+        if not os.path.isfile(config_file):
+            raise BadCommand('%sError: CONFIG_FILE not found at: %s\nPlease specify a CONFIG_FILE' % (self.parser.get_usage(), config_file))
+        
+        config_name = 'config:%s' % config_file
+        here_dir = os.getcwd()
+        
+        if not self.options.quiet:
+            self.logging_file_config(config_file)
+        
+        sys.path.insert(0, here_dir)
+        
+        # Load the wsgi app first so that the templating engines are configured.  This may already
+        # precompile the templates, if web.templating.precompile is enabled.
+        templating.precompiled = None
+        loadapp(config_name, relative_to=here_dir)
+        
+        config = web.core.config
+        packages = self.args[1:]
+        
+        if not packages:
+            root = config.get('web.root.package') or getattr(config.get('web.root'), '__module__', None)
+            
+            if not root:
+                raise BadCommand('Error: Unable to determine the root package; please specify a PACKAGE')
+            
+            packages = [root.split('.', 1)[0]]
+        
+        if templating.precompiled and list(templating.precompiled[0]) == list(packages):
+            compiled, failed = templating.precompiled[1]
+        
+        else:
+            compiled, failed = templating.precompile(packages, self.options.threads)
+        
+        print "Compiled %d templates, %d failed." % (compiled, failed)
+        
+        if failed:
+            return 1
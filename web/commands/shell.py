@@ -6,6 +6,7 @@ import sys
 import paste.fixture
 import paste.registry
 import paste.deploy.config
+import web.core.context
 
 from paste.deploy import loadapp, appconfig
 from paste.script.command import Command, BadCommand
@@ -88,6 +89,7 @@ class ShellCommand(Command):
         test_app.post_request_hook = lambda self: paste.registry.restorer.restoration_begin(request_id)
         
         paste.registry.restorer.restoration_begin(request_id)
+        web.core.context.activate(web.core.context.saved.get(request_id, None))
         
         locs = dict(__name__="webcore-admin", application=wsgiapp, test=test_app)
         
@@ -3,8 +3,8 @@
 import sys
 
 from webob import exc as http
-from paste.registry import StackedObjectProxy
 from web import release
+from web.core.context import ContextProxy
 from web.core.application import Application
 from web.core.dialects import Dialect, Controller, HTTPMethod, RESTMethod
 from web.core.middleware import middleware
@@ -21,12 +21,12 @@ __all__ = [
 
 config = Bunch()
 
-request = StackedObjectProxy(name="request")
-response = StackedObjectProxy(name="response")
-cache = StackedObjectProxy(name="cache")
-session = StackedObjectProxy(name="session")
+request = ContextProxy("request")
+response = ContextProxy("response")
+cache = ContextProxy("cache")
+session = ContextProxy("session")
 
-translator = StackedObjectProxy(name="translator")
+translator = ContextProxy("translator")
 
 url = URLGenerator()
 
@@ -6,12 +6,13 @@ Applications which use the WebCore framework plug into this base application.
 """
 
 import types
-import paste
+import paste.registry
 import web
 
 from webob import Request, Response
 from web.core import middleware
-from web.core.dialects import Dialect
+from web.core.dialects import Dialect, Controller
+from web.utils import codec
 from marrow.util.object import load_object
 
 
@@ -43,6 +44,19 @@ class Application(object):
         if not isinstance(self.root, Dialect):
             log.warning("Non-dialect root controller specified.")
             log.warning("We will assume %r is a raw WSGI application, which is probably wrong.", self.root)
+        
+        codec.use(config.get('web.json.codec', None))
+        
+        if isinstance(self.root, Controller):
+            # Build the compiled dispatch table and result cache, if enabled, before serving the first request.
+            self.root.__table__()
+            self.root.__memo__()
+        
+        # Allow the fully constructed root controller to prepare itself before serving the first request.
+        ready = getattr(self.root, '__ready__', None)
+        
+        if ready is not None:
+            ready()
     
     @classmethod
     def middleware(cls):
@@ -128,30 +142,30 @@ class Application(object):
         environment['web.app'] = self.app
         environment['web.base'] = environment.get('SCRIPT_NAME', '')
         
+        context = environment.get('web.context', None)
+        
         try:
-            if environment.has_key('paste.registry'):
-                environment['paste.registry'].register(web.core.request, Request(environment))
-                environment['paste.registry'].register(web.core.response, Response(request=web.core.request))
-                
-                if environment.has_key('beaker.cache'):
-                    environment['paste.registry'].register(web.core.cache, environment['beaker.cache'])
-                
-                if environment.has_key('beaker.session'):
-                    environment['paste.registry'].register(web.core.session, environment['beaker.session'])
+            if context is not None:
+                # The request, response, cache, and session are constructed by the context on first use.
+                context.environ = environment
             
             if environment['PATH_INFO'] == '/_test_vars':
+                request_id = paste.registry.restorer.get_request_id(environment)
                 paste.registry.restorer.save_registry_state(environment)
+                web.core.context.saved[request_id] = context
                 start_response('200 OK', [('Content-type', 'text/plain')])
-                return ['%s' % paste.registry.restorer.get_request_id(environment)]
+                return ['%s' % request_id]
             
             # Treat non-Dialects as plain WSGI apps
             if not isinstance(self.root, Dialect):
                 return self.root(environment, start_response)
             
-            content = self.root(web.core.request._current_obj())
+            content = self.root(context.request if context is not None else web.core.request._current_obj())
         
         except web.core.http.HTTPException, e:
-            environment['paste.registry'].register(web.core.response, e)
+            if context is not None:
+                context.response = e
+            
             return e(environment, start_response)
         
         if isinstance(content, Response):
@@ -0,0 +1,418 @@
+# encoding: utf-8
+
+"""Low-overhead context-local storage for per-request objects.
+
+Each request is given a Context instance, a slotted object holding the request, response, cache,
+session, translator, and authenticated user.  The active context is tracked by a single local
+storage object (a thread-local by default) rather than by a separate stack per global, as is the
+case with paste.registry.StackedObjectProxy.
+
+The module-level globals (web.core.request, web.auth.user, etc.) are ContextProxy instances which
+retrieve the current object with one attribute lookup on the storage and one slot read.  Code
+which makes heavy use of these objects can skip the proxy entirely:
+
+    context = web.core.context.current()
+    context.request.params
+
+The request, response, cache, and session are constructed from the WSGI environment only when first
+accessed, and other objects may be deferred the same way using Context.lazy or Registry.lazy.  An
+endpoint which returns its own Response, or a plain WSGI root, never pays for the unused objects.
+
+The storage backend may be replaced, e.g. with greenlet-local storage for asynchronous servers, by
+setting the `web.context.backend` configuration option to a factory such as `gevent.local:local`.
+"""
+
+import threading
+
+from webob import Request, Response
+from paste.config import CONFIG
+from paste.registry import Registry as PasteRegistry, restorer
+from marrow.util.object import load_object
+
+
+__all__ = ['Context', 'ContextProxy', 'Registry', 'ClosingIterator', 'ConfigMiddleware', 'ContextMiddleware', 'current', 'use', 'saved', 'streamed']
+log = __import__('logging').getLogger(__name__)
+
+_local = threading.local()
+
+saved = dict()
+
+
+def use(backend=None):
+    """Select the local storage factory used to track the active context.
+    
+    Accepts a callable returning an object supporting arbitrary attribute assignment, such as
+    threading.local or gevent.local.local, or a string reference to one.  Defaults to threading.local.
+    """
+    
+    global _local
+    
+    if backend is None:
+        backend = threading.local
+    
+    if isinstance(backend, basestring):
+        backend = load_object(backend)
+    
+    log.debug("Using %r for context-local storage.", backend)
+    _local = backend()
+
+
+def current():
+    """Return the active Context instance, or None if there is no active request."""
+    
+    return getattr(_local, 'context', None)
+
+
+def activate(context):
+    """Make the given Context instance active, returning the previously active one."""
+    
+    previous = getattr(_local, 'context', None)
+    _local.context = context
+    return previous
+
+
+class Context(object):
+    """Storage for the objects associated with a single request.
+    
+    Proxies whose names are not predefined slots are stored in the extras dictionary.
+    
+    Objects may be constructed lazily, on first access, by registering a factory (a callable
+    accepting no arguments) using the lazy method.  The request, response, cache, and session are
+    always constructed this way, from the WSGI environment, unless explicitly assigned.
+    """
+    
+    __slots__ = ('environ', 'request', 'response', 'cache', 'session', 'translator', 'user', 'extras', 'factories')
+    
+    defaults = dict(
+            request = lambda context: Request(context.environ),
+            response = lambda context: Response(request=context.request),
+            cache = lambda context: context.environ['beaker.cache'],
+            session = lambda context: context.environ['beaker.session']
+        )
+    
+    def __init__(self, environ=None):
+        self.environ = environ
+        self.extras = dict()
+        self.factories = dict()
+    
+    def __repr__(self):
+        return "Context(%s)" % (", ".join(i for i in self.__slots__[1:-2] if self.assigned(i)), )
+    
+    def __getattr__(self, name):
+        # Only called for unassigned slots and unknown attributes.
+        if name in ('environ', 'extras', 'factories'):
+            raise AttributeError(name)
+        
+        factory = self.factories.pop(name, None)
+        
+        try:
+            if factory is not None:
+                value = factory()
+            elif name in self.defaults:
+                value = self.defaults[name](self)
+            else:
+                raise AttributeError(name)
+        
+        except KeyError:
+            raise AttributeError(name)
+        
+        if name in self.__slots__:
+            object.__setattr__(self, name, value)
+        else:
+            self.extras[name] = value
+        
+        return value
+    
+    def assigned(self, name):
+        """Determine if the named object has been constructed, without constructing it."""
+        
+        if name not in self.__slots__:
+            return name in self.extras
+        
+        try:
+            getattr(Context, name).__get__(self, Context)
+        except AttributeError:
+            return False
+        
+        return True
+    
+    def lazy(self, name, factory):
+        """Register a callable used to construct the named object on first access."""
+        
+        if name in self.__slots__:
+            try:
+                delattr(self, name)
+            except AttributeError:
+                pass
+        
+        else:
+            self.extras.pop(name, None)
+        
+        self.factories[name] = factory
+
+
+class ContextProxy(object):
+    """A proxy to an attribute of the active Context.
+    
+    A drop-in replacement for paste.registry.StackedObjectProxy.
+    """
+    
+    __slots__ = ('__name', '__slot')
+    
+    def __init__(self, name):
+        object.__setattr__(self, '_ContextProxy__name', name)
+        object.__setattr__(self, '_ContextProxy__slot', name in Context.__slots__)
+    
+    def _current_obj(self):
+        """Return the object currently being proxied to.
+        
+        Raises a TypeError if no object has been registered in the active context.
+        """
+        
+        name = self.__name
+        
+        try:
+            if self.__slot:
+                return getattr(_local.context, name)
+            
+            context = _local.context
+            
+            try:
+                return context.extras[name]
+            except KeyError:
+                return getattr(context, name)
+        
+        except AttributeError:
+            raise TypeError("No object (name: %s) has been registered for this context." % (name, ))
+    
+    def _register(self, context, obj):
+        """Assign the object to this proxy's slot in the given Context."""
+        
+        if context.factories:
+            context.factories.pop(self.__name, None)
+        
+        if self.__slot:
+            setattr(context, self.__name, obj)
+            return
+        
+        context.extras[self.__name] = obj
+    
+    def _lazy(self, context, factory):
+        """Register a factory used to construct this proxy's object in the given Context on first access."""
+        
+        context.lazy(self.__name, factory)
+    
+    def _push_object(self, obj):
+        """Compatibility with StackedObjectProxy; assigns the object within the active context."""
+        
+        context = current()
+        
+        if context is None:
+            context = _local.context = Context()
+        
+        self._register(context, obj)
+    
+    def _pop_object(self, obj=None):
+        """Compatibility with StackedObjectProxy; removes the object from the active context."""
+        
+        context = current()
+        
+        if self.__slot:
+            delattr(context, self.__name)
+            return
+        
+        del context.extras[self.__name]
+    
+    def __dir__(self):
+        try:
+            return sorted(set(dir(self.__class__)) | set(dir(self._current_obj())))
+        except TypeError:
+            return dir(self.__class__)
+    
+    def __getattr__(self, name):
+        return getattr(self._current_obj(), name)
+    
+    def __setattr__(self, name, value):
+        setattr(self._current_obj(), name, value)
+    
+    def __delattr__(self, name):
+        delattr(self._current_obj(), name)
+    
+    def __getitem__(self, key):
+        return self._current_obj()[key]
+    
+    def __setitem__(self, key, value):
+        self._current_obj()[key] = value
+    
+    def __delitem__(self, key):
+        del self._current_obj()[key]
+    
+    def __call__(self, *args, **kw):
+        return self._current_obj()(*args, **kw)
+    
+    def __repr__(self):
+        try:
+            return repr(self._current_obj())
+        except (TypeError, AttributeError):
+            return '<%s.%s object (name: %s) at 0x%x>' % (self.__class__.__module__, self.__class__.__name__, self.__name, id(self))
+    
+    def __iter__(self):
+        return iter(self._current_obj())
+    
+    def __len__(self):
+        return len(self._current_obj())
+    
+    def __contains__(self, key):
+        return key in self._current_obj()
+    
+    def __nonzero__(self):
+        return bool(self._current_obj())
+
+
+class Registry(PasteRegistry):
+    """A paste.registry.Registry which understands ContextProxy instances.
+    
+    Objects registered against a ContextProxy are assigned to the active Context; anything else
+    (e.g. a StackedObjectProxy defined by application code) is handled as paste would, and
+    removed again during cleanup.
+    
+    If an existing paste Registry is given (e.g. one created by an outer RegistryManager) its
+    registration list is shared, allowing the StackedObjectRestorer to continue functioning.
+    """
+    
+    def __init__(self, parent=None):
+        super(Registry, self).__init__()
+        
+        if parent is not None:
+            self.reglist = parent.reglist
+    
+    def register(self, stacked, obj):
+        if isinstance(stacked, ContextProxy):
+            stacked._push_object(obj)
+            return
+        
+        super(Registry, self).register(stacked, obj)
+    
+    replace = register
+    
+    def lazy(self, stacked, factory):
+        """Register a callable used to construct the proxied object on first access.
+        
+        Only ContextProxy instances support deferred construction; the factory is called immediately
+        for any other kind of proxy.
+        """
+        
+        if isinstance(stacked, ContextProxy):
+            context = current()
+            
+            if context is None:
+                context = _local.context = Context()
+            
+            stacked._lazy(context, factory)
+            return
+        
+        self.register(stacked, factory())
+    
+    def multiregister(self, stacklist):
+        for stacked, obj in stacklist:
+            self.register(stacked, obj)
+
+
+def streamed(result):
+    """Determine if a WSGI response iterable is generated as it is iterated, rather than already complete."""
+    
+    return not isinstance(result, (list, tuple))
+
+
+class ClosingIterator(object):
+    """Wrap a WSGI response iterable, calling the given callback once the server has closed it.
+    
+    Used to defer releasing per-request resources until a streamed response has been generated.
+    """
+    
+    __slots__ = ('iterable', 'callback')
+    
+    def __init__(self, iterable, callback):
+        self.iterable = iterable
+        self.callback = callback
+    
+    def __iter__(self):
+        return iter(self.iterable)
+    
+    def close(self):
+        try:
+            close = getattr(self.iterable, 'close', None)
+            
+            if close is not None:
+                close()
+        
+        finally:
+            self.callback()
+
+
+class ConfigMiddleware(object):
+    """Register a copy of the configuration as paste.config.CONFIG for each request.
+    
+    A replacement for paste.config.ConfigMiddleware which registers the configuration with the
+    registry of the enclosing ContextMiddleware, rather than preparing and cleaning up a registry
+    of its own, so that objects registered within it remain available to streamed responses.
+    """
+    
+    def __init__(self, application, config):
+        self.application = application
+        self.config = config
+    
+    def __call__(self, environ, start_response):
+        config = environ['paste.config'] = self.config.copy()
+        environ['paste.registry'].register(CONFIG, config)
+        
+        return self.application(environ, start_response)
+
+
+class ContextMiddleware(object):
+    """Create and activate a Context for the duration of each request.
+    
+    The context is available as environ['web.context'] and a compatible registry as
+    environ['paste.registry'].  This replaces the need for paste's RegistryManager.
+    
+    Objects registered with the registry remain registered until a streamed response is closed.
+    """
+    
+    def __init__(self, application, backend=None):
+        self.application = application
+        
+        if backend is not None:
+            use(backend)
+    
+    def __call__(self, environ, start_response):
+        registry = environ.get('paste.registry', None)
+        
+        if not isinstance(registry, Registry):
+            registry = environ['paste.registry'] = Registry(registry)
+        
+        registry.prepare()
+        context = environ['web.context'] = Context(environ)
+        previous = activate(context)
+        deferred = False
+        
+        try:
+            result = self.application(environ, start_response)
+            
+            if streamed(result):
+                deferred = True
+                return ClosingIterator(result, registry.cleanup)
+            
+            return result
+        
+        except:
+            # Save state for paste's EvalException if present.
+            if environ.get('paste.evalexception'): # pragma: no cover
+                restorer.save_registry_state(environ)
+            
+            raise
+        
+        finally:
+            if not deferred:
+                registry.cleanup()
+            
+            activate(previous)
@@ -1,36 +1,155 @@
 # encoding: utf-8
 
-"""Basic dispatch routing."""
+"""Basic dispatch routing.
+
+Resolution of dotted method names (as used by the RPC dialects) is cached per root controller
+instance.  Assigning or deleting a routable attribute (a method or nested controller) of a Routable
+controller invalidates the cached routes which pass through that controller; call invalidate()
+directly after making other changes to the controller structure, such as modifying class
+attributes.  Routes which pass through properties are never cached.
+"""
+
+import web
 
 from api import Dialect
 from web.core.http import HTTPNotImplemented
+from web.utils.cache import LRUCache
+from marrow.util.convert import integer
+from marrow.util.object import getargspec
 
 
-__all__ = ['route']
+__all__ = ['RoutingError', 'Route', 'Routable', 'route', 'resolve', 'routes', 'invalidate']
 log = __import__('logging').getLogger(__name__)
 
+_generation = [0]
 
-def route(root, method, expects):
+
+class RoutingError(HTTPNotImplemented):
+    def __init__(self):
+        HTTPNotImplemented.__init__(self, 'An attempt was made to call a method that can not be routed.')
+
+
+class Route(object):
+    """The result of resolving a dotted method name: the callable, its parent, and its argspec.
+    
+    The argspec, as returned by marrow.util.object.getargspec, is calculated on first access.
+    """
+    
+    __slots__ = ('callable', 'parent', '_argspec', 'generation', 'path')
+    
+    def __init__(self, callable, parent, generation=None, path=()):
+        self.callable = callable
+        self.parent = parent
+        self._argspec = None
+        self.generation = generation
+        self.path = tuple((i, getattr(i, '_generation', 0)) for i in path)
+    
+    def __iter__(self):
+        return iter((self.callable, self.parent))
+    
+    @property
+    def argspec(self):
+        if self._argspec is None:
+            self._argspec = getargspec(self.callable)
+        
+        return self._argspec
+    
+    @property
+    def valid(self):
+        """True if no controller along the route has been modified since it was resolved."""
+        
+        if self.generation != _generation[0]:
+            return False
+        
+        for obj, generation in self.path:
+            if getattr(obj, '_generation', 0) != generation:
+                return False
+        
+        return True
+
+
+def _routable(value):
+    return isinstance(value, Dialect) or hasattr(value, '__call__')
+
+
+class Routable(object):
+    """Invalidate cached routes passing through a controller when its routable attributes change.
+    
+    Assigning or deleting a method or nested controller increments the controller's _generation;
+    other values, such as per-request state, do not affect cached routes.
+    """
+    
+    _generation = 0
+    
+    def _existing(self, name):
+        return self.__dict__.get(name, getattr(type(self), name, None))
+    
+    def __setattr__(self, name, value):
+        modified = not name.startswith('_') and (_routable(value) or _routable(self._existing(name)))
+        super(Routable, self).__setattr__(name, value)
+        
+        if modified:
+            self._generation += 1
+    
+    def __delattr__(self, name):
+        modified = not name.startswith('_') and _routable(self._existing(name))
+        super(Routable, self).__delattr__(name)
+        
+        if modified:
+            self._generation += 1
+
+
+def invalidate(root=None):
+    """Discard the cached routes of the given root controller, or of all root controllers."""
+    
+    if root is None:
+        _generation[0] += 1
+        return
+    
+    cache = getattr(root, '__dict__', dict()).get('_routes', None)
+    
+    if cache is not None:
+        cache.clear()
+
+
+def walk(root, method, expects):
+    return trace(root, method, expects)[:2]
+
+
+def trace(root, method, expects):
+    """Return the callable, its parent, and the controllers traversed for the given dotted method name.
+    
+    The controllers traversed are None if the route passes through a property, and so may change
+    from request to request.
+    """
+    
     last = None
     part = root
     parts = method.split('.')
     parts.reverse()
+    path = []
     
     while True:
         last = part
         part = parts[-1]
         
+        if path is not None:
+            path.append(last)
+            
+            if isinstance(getattr(last if isinstance(last, type) else type(last), part, None), property):
+                path = None
+        
         log.debug("Looking for %r attribute of %r.", part, last)
         
         if part.startswith('_'):
             log.error("An attempt was made to route a private object: %s", method)
-            raise HTTPNotImplemented('An attempt was made to call a method that can not be routed.')
+            raise RoutingError()
         
         part = getattr(last, part, None)
         
         if not isinstance(part, expects) and isinstance(part, Dialect):
-            log.error("Context switching to another dilect from the current RPC dialect is not allowed.")
-            raise HTTPNotImplemented('An attempt was made to call a method that can not be routed.')
+            log.error("Context switching to another dialect from the current RPC dialect is not allowed.")
+            raise RoutingError()
         
         if isinstance(part, expects):
             log.debug("Continuing descent through controller structure.")
@@ -39,11 +158,87 @@ def route(root, method, expects):
         
         if hasattr(part, '__call__') and parts[1:]:
             log.error("Callable method found before reaching the end of the call tree.")
-            raise HTTPNotImplemented('An attempt was made to call a method that can not be routed.')
+            raise RoutingError()
         
         if hasattr(part, '__call__'):
             parts.pop()
-            return part, last
+            return part, last, path
+        
+        log.error("An attempt as made to call an unroutable method: %s", method)
+        raise RoutingError()
+
+
+def routes(root, expects, prefix='', _seen=None):
+    """Generate (method, callable, parent) for every method routable from the given root.
+    
+    This descends through the controller structure following the same rules as route: private
+    attributes are skipped, as are other dialects and properties.
+    """
+    
+    seen = _seen if _seen is not None else set()
+    
+    if id(root) in seen:
+        return
+    
+    seen.add(id(root))
+    cls = root if isinstance(root, type) else type(root)
+    
+    for name in dir(root):
+        if name.startswith('_') or isinstance(getattr(cls, name, None), property):
+            continue
+        
+        part = getattr(root, name, None)
+        
+        if isinstance(part, expects):
+            for route in routes(part, expects, prefix + name + '.', seen):
+                yield route
+            
+            continue
+        
+        if isinstance(part, Dialect) or not hasattr(part, '__call__'):
+            continue
         
-        log.error("An attmpt as made to call an unroutable method: %s", method)
-        raise HTTPNotImplemented('An attempt was made to call a method that can not be routed.')
+        yield prefix + name, part, root
+
+
+def resolve(root, method, expects):
+    """Return the Route for the given dotted method name, searching from the root controller.
+    
+    Successful resolutions are cached on the root controller instance; the size of the cache is
+    controlled by the `web.rpc.cache` configuration option (default 128, 0 to disable).
+    """
+    
+    generation = _generation[0]
+    
+    try:
+        cache = root.__dict__['_routes']
+    
+    except KeyError:
+        if isinstance(root, type):
+            return Route(*walk(root, method, expects))
+        
+        cache = root.__dict__['_routes'] = LRUCache(integer(web.core.config.get('web.rpc.cache', 128)))
+    
+    except AttributeError:
+        return Route(*walk(root, method, expects))
+    
+    key = (method, expects)
+    entry = cache.get(key)
+    
+    if entry is not None and entry.valid:
+        return entry
+    
+    callable, parent, path = trace(root, method, expects)
+    
+    if path is None:
+        cache.pop(key)
+        return Route(callable, parent)
+    
+    return cache.set(key, Route(callable, parent, generation, path))
+
+
+def route(root, method, expects):
+    """Return the (callable, parent) pair for the given dotted method name."""
+    
+    entry = resolve(root, method, expects)
+    return entry.callable, entry.parent
@@ -4,11 +4,55 @@ import web
 
 from api import Dialect
 
-from marrow.util.convert import boolean
+from marrow.util.convert import boolean, integer
+from web.utils.cache import LRUCache
 
 
 log = __import__('logging').getLogger(__name__)
-__all__ = ['Controller']
+__all__ = ['Controller', 'DispatchTable', 'DispatchEntry', 'DispatchCache', 'invalidate']
+
+
+class DispatchTable(object):
+    """A precomputed level of the controller tree used by compiled dispatch.
+    
+    Each table maps the public attribute names of a single Controller instance
+    to a 2-tuple of the nested table (for Controller attributes) and the
+    attribute value itself, allowing descent through the static portion of
+    the tree using dictionary lookups alone.
+    
+    Properties and anything else which can not be safely evaluated ahead of
+    time are omitted; these are resolved dynamically during dispatch.
+    """
+    
+    __slots__ = ('controller', 'trailing', 'children')
+    
+    def __init__(self, controller, trailing=True, seen=None):
+        seen = {} if seen is None else seen
+        seen[id(controller)] = self
+        
+        self.controller = controller
+        self.trailing = getattr(controller, '__trailing_slash__', trailing)
+        self.children = dict()
+        
+        cls = type(controller)
+        
+        for name in dir(controller):
+            if name.startswith('_') or isinstance(getattr(cls, name, None), property):
+                continue
+            
+            value = getattr(controller, name, None)
+            
+            if isinstance(value, Controller):
+                table = seen.get(id(value), None)
+                self.children[name] = (table if table else DispatchTable(value, trailing, seen), value)
+            
+            elif isinstance(value, Dialect) or hasattr(value, '__call__'):
+                self.children[name] = (None, value)
+        
+        log.debug("Compiled dispatch table for %r with %d entries.", controller, len(self.children))
+    
+    def __repr__(self):
+        return "DispatchTable(%r, %r)" % (self.controller, sorted(self.children))
 
 
 class Controller(Dialect):
@@ -29,9 +73,52 @@ class Controller(Dialect):
     This will likely be the most often used dialect as it offers the fastest prototyping
     and reasonable performance.
     
+    If the `web.dispatch.compiled` configuration option is enabled the controller tree
+    is walked once, on the first request, and the result stored as a tree of
+    DispatchTable instances.  Subsequent requests resolve the static portion of the
+    path using dictionary lookups, falling back on dynamic attribute access and the
+    `__default__` and `__lookup__` mechanisms for anything not found in the table.
+    
     For improved performance, consider using a RoutingController.
     """
     
+    def __table__(self):
+        """Return the compiled DispatchTable for this controller, building it if needed.
+        
+        Returns None if compiled dispatch has not been enabled.
+        """
+        
+        try:
+            return self.__dict__['__dispatch_table__']
+        except KeyError:
+            pass
+        
+        config = web.core.config
+        table = None
+        
+        if boolean(config.get('web.dispatch.compiled', False)):
+            table = DispatchTable(self, boolean(config.get('trailing_slashes', True)))
+        
+        self.__dict__['__dispatch_table__'] = table
+        return table
+    
+    def __memo__(self):
+        """Return the DispatchCache for this controller, building it if needed.
+        
+        Returns None if dispatch result caching has not been enabled.
+        """
+        
+        try:
+            return self.__dict__['__dispatch_cache__']
+        except KeyError:
+            pass
+        
+        capacity = integer(web.core.config.get('web.dispatch.cache', 0))
+        memo = DispatchCache(capacity) if capacity else None
+        
+        self.__dict__['__dispatch_cache__'] = memo
+        return memo
+    
     def __call__(self, request):
         """Non-recursively descend through Controller instances.
         
@@ -40,7 +127,20 @@ class Controller(Dialect):
         
         last = None
         part = self
-        trailing = boolean(web.core.config.get('trailing_slashes', True))
+        table = self.__table__()
+        memo = self.__memo__()
+        data = None
+        
+        if memo is not None:
+            original = request.path_info
+            entry = memo.match(original)
+            
+            if entry is not None:
+                log.debug("Using memoized dispatch for %r.", original)
+                return entry(request)
+            
+            # Track the changes made to the request so they may be replayed later.
+            ops, exact, cacheable = [], False, True
         
         while True:
             last = part
@@ -52,50 +152,75 @@ class Controller(Dialect):
                 # attempt to call the index method, then attempt the default, or bail
                 # with a 404 error.
                 
-                if not request.path.endswith('/') and getattr(last, '__trailing_slash__', trailing):
+                if not request.path.endswith('/') and (table.trailing if table else \
+                        getattr(last, '__trailing_slash__', boolean(web.core.config.get('trailing_slashes', True)))):
                     location = request.path + '/' + (('?' + request.query_string) if request.query_string else '')
                     log.debug("Trailing slash omitted from path, redirecting to %s.", location)
                     raise web.core.http.HTTPMovedPermanently(location=location)
                 
                 log.debug("No method given, searching for index method.")
                 part = 'index'
+                
+                if memo is not None:
+                    exact = True
             
             log.debug("Looking for %r attribute of %r.", part, last)
             part, request.format = part.rsplit('.', 1) if '.' in part else (part, None)
-            protected, part = part.startswith('_'), getattr(last, part, None)
-            request.charset = 'utf8'
-            data = request.params.mixed()
-            remaining = request.path_info.strip('/')
-            remaining = remaining.split('/') if remaining else []
+            
+            if table and part in table.children:
+                protected = False
+                table, part = table.children[part]
+            
+            else:
+                table = None
+                
+                if memo is not None and isinstance(getattr(type(last), part, None), property):
+                    # The target of a property may change from request to request.
+                    cacheable = False
+                
+                protected, part = part.startswith('_'), getattr(last, part, None)
+            
+            if data is None:
+                request.charset = 'utf8'
+                data = request.params.mixed()
+            
+            entry = None
             
             if not isinstance(part, Controller) and isinstance(part, Dialect):
                 log.debug("Context switching from Controller to other Dialect instance.")
-                request.path_info_pop()
-                return part(request)
+                entry = DispatchEntry(DispatchEntry.DIALECT, last, part, request.format)
             
             # If the URL portion exists as an attribute on the object in question, start searching again on that attribute.
-            if isinstance(part, Controller):
+            elif isinstance(part, Controller):
                 log.debug("Continuing descent through controller structure.")
                 request.path_info_pop()
+                
+                if memo is not None:
+                    ops.append(None)
+                
                 continue
             
             # If the current object under consideration is a decorated controller method, the search is ended.
-            if hasattr(part, '__call__') and not protected:
-                log.debug("Found callable, passing control. part(%r, %r)", remaining[1:], data)
-                request.path_info_pop()
-                remaining, data = last.__before__(*remaining[1:], **data)
-                return last.__after__(part(*remaining, **data))
-            
-            fallback = None
+            elif hasattr(part, '__call__') and not protected:
+                entry = DispatchEntry(DispatchEntry.METHOD, last, part, request.format)
             
-            try: fallback = last.__default__
-            except AttributeError: pass
+            else:
+                fallback = None
+                
+                try: fallback = last.__default__
+                except AttributeError: pass
+                
+                if fallback:
+                    # If the current object under consideration has a “default” method then the search is ended with that method returned.
+                    entry = DispatchEntry(DispatchEntry.DEFAULT, last, fallback, request.format)
             
-            if fallback:
-                # If the current object under consideration has a “default” method then the search is ended with that method returned.
-                log.debug("Calling default method of %r.", last)
-                remaining, data = last.__before__(*remaining, **data)
-                return last.__after__(fallback(*remaining, **data))
+            if entry is not None:
+                if memo is not None and cacheable:
+                    entry.ops = tuple(ops)
+                    entry.exact = exact
+                    memo.set(original if exact else DispatchCache.prefix(original, request.path_info), entry)
+                
+                return entry.invoke(request, data)
             
             try: fallback = last.__lookup__
             except AttributeError: pass
@@ -103,8 +228,17 @@ class Controller(Dialect):
             if fallback:
                 # If the current object under consideration has a “lookup” method then execute the “lookup” method, and start the search again on the return value of that method.
                 log.debug("Calling lookup method of %r.", last)
+                remaining = request.path_info.strip('/')
+                remaining = remaining.split('/') if remaining else []
                 part, remaining = fallback(*remaining, **data)
                 request.path_info = '/' + '/'.join(remaining) + ('/' if request.path.endswith('/') else '')
+                
+                if memo is not None:
+                    # Lookup results depend on more than the path prefix; only cache the whole path, if allowed.
+                    cacheable = cacheable and getattr(last, '__cacheable_lookup__', False)
+                    exact = True
+                    ops.append(request.path_info)
+                
                 continue
             
             raise web.core.http.HTTPNotFound()
@@ -125,3 +259,126 @@ class Controller(Dialect):
     def __after__(self, result, *args, **kw):
         """The __after__ method can modify the value returned by the final method call."""
         return result
+
+
+class DispatchEntry(object):
+    """The memoized result of object dispatch.
+    
+    Records the changes made to the request during descent (path segments consumed and paths
+    rewritten by `__lookup__`) as well as the final controller, target callable, and requested
+    format, allowing the result to be replayed against a later request without walking the tree.
+    """
+    
+    DIALECT, METHOD, DEFAULT = range(3)
+    
+    __slots__ = ('kind', 'parent', 'target', 'format', 'ops', 'exact')
+    
+    def __init__(self, kind, parent, target, format=None, ops=(), exact=False):
+        self.kind = kind
+        self.parent = parent
+        self.target = target
+        self.format = format
+        self.ops = ops
+        self.exact = exact
+    
+    def __repr__(self):
+        return "DispatchEntry(%r, %r, %r, %r)" % (self.kind, self.parent, self.target, self.format)
+    
+    def __call__(self, request):
+        """Replay the recorded descent against the given request, then invoke the target."""
+        
+        for op in self.ops:
+            if op is None:
+                request.path_info_pop()
+                continue
+            
+            request.path_info = op
+        
+        request.environ['web.controller'] = request.script_name
+        request.format = self.format
+        
+        return self.invoke(request)
+    
+    def invoke(self, request, data=None):
+        """Invoke the target, consuming the final path segment if appropriate."""
+        
+        if self.kind == self.DIALECT:
+            request.path_info_pop()
+            return self.target(request)
+        
+        if data is None:
+            request.charset = 'utf8'
+            data = request.params.mixed()
+        
+        remaining = request.path_info.strip('/')
+        remaining = remaining.split('/') if remaining else []
+        parent = self.parent
+        
+        if self.kind == self.METHOD:
+            log.debug("Found callable, passing control. part(%r, %r)", remaining[1:], data)
+            request.path_info_pop()
+            remaining = remaining[1:]
+        
+        else:
+            log.debug("Calling default method of %r.", parent)
+        
+        remaining, data = parent.__before__(*remaining, **data)
+        return parent.__after__(self.target(*remaining, **data))
+
+
+class DispatchCache(LRUCache):
+    """A bounded cache of DispatchEntry instances keyed on the portion of PATH_INFO examined.
+    
+    Object dispatch only considers one path segment per level of descent, so the result of
+    resolving a path prefix applies to any path beginning with that prefix.  Entries which depend
+    on the entire path (index methods and those involving `__lookup__`) are flagged exact and only
+    match the path they were recorded against.
+    """
+    
+    @staticmethod
+    def prefix(original, path):
+        """Return the portion of the original path consumed up to and including the next segment of path."""
+        
+        stripped = path.lstrip('/')
+        end = stripped.find('/')
+        end = len(stripped) if end == -1 else end
+        
+        return original[:len(original) - len(stripped) + end]
+    
+    def match(self, path):
+        """Return the entry for the longest cached prefix of the given path, or None."""
+        
+        entry = self.get(path)
+        
+        if entry is not None:
+            return entry
+        
+        candidate = path.rstrip('/')
+        
+        if candidate == path:
+            candidate = candidate.rpartition('/')[0]
+        
+        while candidate:
+            entry = self.get(candidate)
+            
+            if entry is not None and not entry.exact:
+                return entry
+            
+            candidate = candidate.rpartition('/')[0]
+        
+        return None
+
+
+def invalidate(root, prefix=None):
+    """Discard memoized dispatch results for the given root controller.
+    
+    If a path prefix is given only the entries recorded beneath that path are discarded.  Call
+    this after modifying the controller tree at runtime.
+    """
+    
+    memo = root.__dict__.get('__dispatch_cache__', None)
+    
+    if memo is None:
+        return 0
+    
+    return memo.invalidate(None if prefix is None else (lambda key: key.startswith(prefix)))
@@ -7,7 +7,23 @@ from webob import Request, Response
 
 
 log = __import__('logging').getLogger(__name__)
-__all__ = ['HTTPMethod', 'RESTMethod']
+__all__ = ['HTTPMethodType', 'HTTPMethod', 'RESTMethod']
+
+
+class HTTPMethodType(type):
+    """Determine the verbs an HTTPMethod subclass responds to when the class is defined.
+    
+    The list of allowed verbs and the rendered Allow header are stored on the class, rather than
+    being recalculated for every instance and request.
+    """
+    
+    verbs = ('get', 'put', 'post', 'delete', 'head', 'trace', 'options')
+    
+    def __init__(cls, name, bases, attrs):
+        super(HTTPMethodType, cls).__init__(name, bases, attrs)
+        
+        cls.__verbs__ = tuple(i.upper() for i in cls.verbs if hasattr(getattr(cls, i, None), '__call__'))
+        cls.__allow__ = ', '.join(cls.__verbs__)
 
 
 class HTTPMethod(object):
@@ -20,30 +36,36 @@ class HTTPMethod(object):
     With this it would possible to create a WebDAV system.
     """
     
+    __metaclass__ = HTTPMethodType
+    
     def __init__(self):
         super(HTTPMethod, self).__init__()
         
-        methods = []
-        
-        for i in ['get', 'put', 'post', 'delete', 'head', 'trace', 'options']:
-            if hasattr(self, i) and hasattr(getattr(self, i), '__call__'):
-                methods.append(i.upper())
-        
-        self.methods = methods
+        self.methods = list(self.__verbs__)
+        self.__handlers = dict((verb, getattr(self, verb.lower())) for verb in self.__verbs__)
     
     def __call__(self, *args, **kw):
-        verb = kw.pop('_verb', web.core.request.method).lower()
-        web.core.request.method = verb.upper()
-        web.core.response.allow = self.methods
+        request = web.core.request._current_obj()
+        verb = kw.pop('_verb', None)
+        
+        if verb is None:
+            verb = request.method
+        
+        else:
+            verb = request.method = verb.upper()
+        
+        web.core.response.headers['Allow'] = self.__allow__
         
         log.debug("Performing HTTP dispatch to %s(%r, %r)", verb, args, kw)
         
-        if verb.upper() not in self.methods:
-            raise web.core.http.HTTPMethodNotAllowed()
+        try:
+            handler = self.__handlers[verb]
+        except KeyError:
+            raise web.core.http.HTTPMethodNotAllowed(headers=[('Allow', self.__allow__)])
         
         args, kw = self.__before__(*args, **kw)
         
-        return self.__after__(getattr(self, verb)(*args, **kw), *args, **kw)
+        return self.__after__(handler(*args, **kw), *args, **kw)
     
     index = __call__
     __default__ = __call__
@@ -68,9 +90,28 @@ class HTTPMethod(object):
     def head(self, *args, **kw):
         """Allow the get method to set headers, but return no content.
         
-        This performs an internal GET and strips the body from the response.
+        This performs an internal GET but does not render the result: string bodies only contribute
+        their length, and templates and iterables are discarded without being rendered or consumed.
         """
-        return self.get(*args, **kw)
+        
+        result = self.get(*args, **kw)
+        
+        if isinstance(result, Response):
+            return result
+        
+        response = web.core.response._current_obj()
+        response.app_iter = []
+        
+        if isinstance(result, unicode):
+            response.content_length = len(result.encode(response.charset))
+        
+        elif isinstance(result, str):
+            response.content_length = len(result)
+        
+        elif hasattr(result, 'close'):
+            result.close()
+        
+        return response
     
     def options(self, *args, **kw):
         """The allowed methods are present in the returned headers."""
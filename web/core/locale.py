@@ -6,18 +6,29 @@ import os
 import web
 import warnings
 
-from gettext import NullTranslations, translation
+from gettext import NullTranslations, translation, _expand_lang
 from web.core.templating import registry
-from marrow.util.convert import array
+from web.utils.cache import LRUCache
+from web.utils.catalog import MMapTranslations
+from marrow.util.convert import array, integer
 
 
 __all__ = [
         'LanguageError', '_', '__', 'L_', 'N_', 'gettext', 'ugettext', 'ngettext', 'ungettext', 'get_lang', 'set_lang',
-        'get_translator'
+        'get_translator', 'negotiate', 'translate'
     ]
 
 log = __import__('logging').getLogger(__name__)
 
+# Fully built translator chains, by text domain, locale directory, and language list.
+_translators = LRUCache(256)
+
+# The languages with translations available, by text domain and locale directory.
+_available = dict()
+
+# Negotiated language lists, by Accept-Language header and available languages.
+_negotiated = LRUCache(256)
+
 
 class LanguageError(Exception):
     """Exception raised when a problem occurs with changing languages"""
@@ -49,13 +60,31 @@ __ = ungettext
 
 
 class L_(object):
-    """Lazy version of ugettext."""
+    """Lazy version of ugettext.
+
+    The translation is remembered along with the translator used, so using the same lazy string
+    several times within a request costs a single catalog lookup.
+    """
     def __init__(self, message):
         self.__message = message
+        self.__unicode = self.__str = (None, None)
+
+    def _translate(self, translator=None):
+        """Return the translation using the given translator, or that of the current request."""
+        if translator is None:
+            translator = web.core.translator._current_obj()
+
+        cached, value = self.__unicode
+
+        if cached is not translator:
+            value = translator.ugettext(self.__message)
+            self.__unicode = (translator, value)
+
+        return value
 
     @property
     def __translated(self):
-        return web.core.translator.ugettext(self.__message)
+        return self._translate()
 
     def __add__(self, other):
         return self.__translated + other
@@ -64,14 +93,46 @@ class L_(object):
         return getattr(self.__translated, name)
     
     def __str__(self):
-        return web.core.translator.gettext(self.__message)
+        translator = web.core.translator._current_obj()
+        cached, value = self.__str
+
+        if cached is not translator:
+            value = translator.gettext(self.__message)
+            self.__str = (translator, value)
+
+        return value
 
     def __unicode__(self):
-        return web.core.translator.ugettext(self.__message)
+        return self.__translated
+
+
+def translate(messages):
+    """Translate a collection of messages, such as the labels of a form or menu, in one call.
+
+    Accepts a mapping, returning a dictionary of the translated values, or any other iterable,
+    returning a list.  Messages may be strings or L_ instances.
+    """
+    translator = web.core.translator._current_obj()
+
+    def one(message):
+        if isinstance(message, L_):
+            return message._translate(translator)
+
+        return translator.ugettext(message)
+
+    if hasattr(messages, 'items'):
+        return dict((key, one(value)) for key, value in messages.items())
+
+    return [one(message) for message in messages]
 
 
 def get_translator(lang, conf=None, **kwargs):
-    """Utility method to get a valid translator object from a language name."""
+    """Utility method to get a valid translator object from a language name.
+
+    Translators are cached by language list.  If the languages with translations available are known
+    (they are once the LocaleMiddleware has started) any other languages are ignored, and if none
+    remain a NullTranslations instance is returned.
+    """
     if not lang:
         return NullTranslations()
 
@@ -82,16 +143,114 @@ def get_translator(lang, conf=None, **kwargs):
         lang = [lang]
 
     domain = conf.get('web.locale.domain') or conf['web.root.package']
-    try:
-        translator = translation(domain, conf['web.locale.path'], languages=lang, **kwargs)
-    except IOError, ioe: # pragma: no cover
-        raise LanguageError('IOError: %s' % ioe)
+    path = conf['web.locale.path']
+    key = (domain, path, tuple(lang))
+
+    if not kwargs:
+        translator = _translators.get(key)
+
+        if translator is not None:
+            return translator
+
+    languages = lang
+    available = _available.get((domain, path))
+
+    if available is not None:
+        languages = _prune(lang, available)
+
+    if languages:
+        options = dict(kwargs)
+
+        if conf.get('web.locale.catalog', 'gettext') == 'mmap':
+            options.setdefault('class_', MMapTranslations)
+
+        try:
+            translator = translation(domain, path, languages=languages, **options)
+        except IOError, ioe: # pragma: no cover
+            raise LanguageError('IOError: %s' % ioe)
+
+    else:
+        translator = NullTranslations()
 
     translator.lang = lang
 
+    if not kwargs:
+        _translators.set(key, translator)
+
     return translator
 
 
+def _prune(languages, available):
+    """Expand the given languages as gettext does, keeping only those with translations available."""
+    result = []
+
+    for language in languages:
+        for candidate in _expand_lang(language):
+            if candidate in available and candidate not in result:
+                result.append(candidate)
+
+    return result
+
+
+def negotiate(header, available=None):
+    """Return the languages acceptable according to an Accept-Language header, most preferred first.
+
+    Languages are ordered by quality, then by position in the header; those with a quality of zero
+    are omitted.  Language tags are converted to the form used to name locale directories (en-us
+    becomes en_US) and each regional variant is followed by its primary language.  If the set of
+    available languages is given any others are omitted.  Results are cached.
+    """
+    key = (header, available)
+    result = _negotiated.get(key)
+
+    if result is not None:
+        return result
+
+    ranked = []
+
+    for index, part in enumerate(header.split(',')):
+        part = part.split(';')
+        tag = part[0].strip()
+
+        if not tag or tag == '*':
+            continue
+
+        quality = 1.0
+
+        for parameter in part[1:]:
+            name, sep, value = parameter.partition('=')
+
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+
+        if quality > 0:
+            ranked.append((-quality, index, tag))
+
+    ranked.sort()
+
+    known = None if available is None else dict((i.lower(), i) for i in available)
+    result = []
+
+    for quality, index, tag in ranked:
+        parts = tag.replace('_', '-').split('-')
+        candidates = [parts[0].lower()]
+
+        if len(parts) > 1:
+            candidates.insert(0, candidates[0] + '_' + parts[1].upper())
+
+        for candidate in candidates:
+            if known is not None:
+                candidate = known.get(candidate.lower())
+
+            if candidate and candidate not in result:
+                result.append(candidate)
+
+    return _negotiated.set(key, tuple(result))
+
+
 def set_lang(lang, **kwargs):
     """Set the current language used for translations.
     
@@ -138,6 +297,10 @@ class LocaleMiddleware(object):
         languages = self._find_translations(localedir, domain)
         log.info("Supported languages: %r", languages)
 
+        _available[(domain, self.config.get('web.locale.path', localedir))] = frozenset(languages)
+        _translators.capacity = integer(self.config.get('web.locale.cache', 256))
+        _negotiated.capacity = integer(self.config.get('web.locale.negotiation.cache', 256))
+
         # Register the appropriate i18n functions in the global template scope.
         registry.append({'_': _, '__': __, 'L_': L_, 'N_': N_})
 
@@ -217,18 +380,18 @@ class LocaleMiddleware(object):
     
     @classmethod
     def parse_linguas(cls, environ):
-        languages = []
-        languages.extend(environ.get('beaker.session', {}).get('lang', []))
-        
-        for i in environ.get('HTTP_ACCEPT_LANGUAGE', '').split(','):
-            i = i.strip(', ')
-            i = i.split(';', 1)[0]
-            languages.append(i)
-            
-            if '-' in i:
-                languages.append(i.split('-', 1)[0])
-        
-        languages.extend(environ['paste.config'].get('web.locale.fallback', ['en']))
+        """Return the languages for a request: those chosen using set_lang, negotiated, and the fallback."""
+        conf = environ['paste.config']
+        domain = conf.get('web.locale.domain') or conf.get('web.root.package')
+        available = _available.get((domain, conf.get('web.locale.path')))
+
+        languages = list(environ.get('beaker.session', {}).get('lang', []))
+        negotiated = negotiate(environ.get('HTTP_ACCEPT_LANGUAGE', ''), available)
+
+        for language in negotiated + tuple(array(conf.get('web.locale.fallback', 'en'))):
+            if language not in languages:
+                languages.append(language)
+
         return languages
 
     def __call__(self, environ, start_response):
@@ -167,7 +167,7 @@ def configuration(app, config):
     if not defaultbool(config.get('web.config', True), ['paste']):
         return app
     
-    from paste.config import ConfigMiddleware
+    from web.core.context import ConfigMiddleware
     return ConfigMiddleware(app, config)
 
 
@@ -257,6 +257,13 @@ def debugging(app, config):
 
 @middleware('registry', after="debugging")
 def threadlocal(app, config):
+    from web.core.context import ContextMiddleware
+    app = ContextMiddleware(app, config.get('web.context.backend', None))
+    
+    # Paste's RegistryManager is no longer required, but may be enabled for compatibility.
+    if not defaultbool(config.get('web.registry', False), ['paste']):
+        return app
+    
     from paste.registry import RegistryManager
     return RegistryManager(app)
 
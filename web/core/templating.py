@@ -2,86 +2,711 @@
 
 import os
 
+from threading import Lock
 from functools import wraps
+from hashlib import sha1
+from uuid import uuid4
 
-from marrow.templating.core import Engines
+from pkg_resources import resource_listdir, resource_filename
 
-from web.core import request, response
+from marrow.templating.core import Engines, Resolver
+from marrow.util.convert import boolean, integer, array
+
+from web.core import response
+from web.core.context import current, activate
+from web.core.middleware import defaultbool
+from web.utils import codec
+from web.utils.cache import LRUCache
 
 from marrow.util.compat import unicode
 
 
-__all__ = ['resolve', 'registry', 'render', 'template', 'TemplatingMiddleware']
+__all__ = ['resolve', 'registry', 'refresh', 'render', 'stream', 'streamers', 'template', 'fragments', 'invalidate', 'precompile', 'TemplatingMiddleware']
 log = __import__('logging').getLogger(__name__)
 
+class TemplateResolver(Resolver):
+    """Resolve template specifications to an engine and filename, caching the results.
+
+    Results are cached by template specification and default engine.  If revalidate is enabled
+    (it is when running with debug enabled) the modification time of the resolved file is checked
+    on each use, and the template is resolved again if it has changed or disappeared; otherwise
+    results are cached permanently, and the file system is not consulted again.
+    """
+
+    def __init__(self, default=None, capacity=1024, revalidate=False):
+        super(TemplateResolver, self).__init__(default, 0)
+
+        self.cache = LRUCache(capacity)
+        self.revalidate = revalidate
+
+    def __call__(self, template):
+        key = (template, self.default)
+        entry = self.cache.get(key)
+
+        if entry is not None:
+            result, mtime = entry
+
+            if not self.revalidate or mtime == _mtime(result[1]):
+                return result
+
+        result = self.find(template)
+        self.cache.set(key, (result, _mtime(result[1]) if self.revalidate else None))
+
+        return result
+
+    def find(self, template):
+        """Resolve the given template specification without using the cache."""
+
+        engine, package, path = self.parse(template)
+
+        if not package:
+            if not path:
+                # Handle bare engines, e.g. serializers.
+                return engine, None
+
+            # Handle absolute and relative paths.
+            return engine, os.path.abspath(path.replace('/', os.path.sep))
+
+        parts = package.split('.')
+        if not path: parts, path = parts[:-1], parts[-1]
+
+        path = path.split('/')
+
+        possibilities = [i for i in resource_listdir('.'.join(parts), '/'.join(path[:-1])) if i.startswith(path[-1] + '.')]
+
+        if len(possibilities) == 1:
+            path[-1] = possibilities[0]
+
+        elif len(possibilities) > 1 and path[-1] not in possibilities:
+            raise ValueError('Ambiguous template name. Please use the following template path syntax: %s/%s.[%s]' % (
+                    '.'.join(parts),
+                    '/'.join(path),
+                    ','.join([i.split('.')[-1] for i in possibilities])
+                ))
+
+        return engine, resource_filename('.'.join(parts), '/'.join(path))
+
+
+def _mtime(filename):
+    if filename is None:
+        return None
+
+    try:
+        return os.stat(filename).st_mtime
+    except OSError:
+        return -1
+
+
+class Namespaces(list):
+    """The list of template namespace providers, counting modifications.
+
+    The generation attribute is incremented whenever the list is modified, allowing the merged
+    namespace to be rebuilt only when the registry changes.
+    """
+
+    generation = 0
+
+
+def _modifies(name):
+    method = getattr(list, name)
+
+    def inner(self, *args, **kw):
+        try:
+            return method(self, *args, **kw)
+        finally:
+            self.generation += 1
+
+    inner.__name__ = name
+    return inner
+
+
+for _name in ('append', 'extend', 'insert', 'pop', 'remove', 'reverse', 'sort', '__setitem__', '__delitem__',
+        '__setslice__', '__delslice__', '__iadd__', '__imul__'):
+    setattr(Namespaces, _name, _modifies(_name))
+
+del _name
+
+
 _render = Engines()
-_lookup = lambda template: resolve(template)[1]
-resolve = _render.resolve
-registry = []
+resolve = _render.resolve = TemplateResolver()
+registry = Namespaces()
+
+_namespace = (None, None, None)
+_relatives = LRUCache(1024)
+
+
+def _lookup(template):
+    return resolve(template)[1]
 
 
 def _relative(parent):
-    parent = _lookup(parent)
+    key = (parent, resolve.default)
+    inner = _relatives.get(key)
+
+    if inner is not None:
+        return inner
+
+    base = os.path.dirname(_lookup(parent))
 
     def inner(template):
-        return os.path.relpath(_lookup(template), os.path.dirname(parent))
-    return inner
+        return os.path.relpath(_lookup(template), base)
+
+    return _relatives.set(key, inner)
+
+
+def _compile():
+    """Merge consecutive static registry entries, returning the base namespace and remaining steps.
+
+    Mappings are merged once, in order, with any callable providers left to be called on each
+    render; the resulting namespace is identical to merging every entry in turn.
+    """
+
+    steps = [dict()]
+
+    for i in registry:
+        if callable(i):
+            steps.append(i)
+        elif callable(steps[-1]):
+            steps.append(dict(i))
+        else:
+            steps[-1].update(i)
+
+    return steps[0], tuple(steps[1:])
+
+
+def refresh():
+    """Discard the merged template namespace and cached template paths.
+
+    Call this after modifying, in place, a mapping which has already been added to the registry.
+    """
+
+    global _namespace
+
+    _namespace = (None, None, None)
+    resolve.cache.clear()
+    _relatives.clear()
+
+
+class MemoryFragments(object):
+    """In-process storage for rendered fragments, bounded in size and optionally in age.
+
+    Tag tokens are bounded by the same capacity; a fragment whose tag token has been discarded is
+    simply rendered again.
+    """
+
+    def __init__(self, capacity=256, ttl=None):
+        self.cache = LRUCache(capacity, ttl)
+        self.tags = LRUCache(capacity)
+
+    def get(self, key):
+        return self.cache.get(key)
+
+    def set(self, key, value, ttl=None):
+        self.cache.set(key, value, ttl)
+
+    def tag(self, name):
+        token = self.tags.get(name)
+
+        if token is None:
+            token = self.tags.set(name, uuid4().hex)
+
+        return token
+
+    def invalidate(self, name):
+        self.tags.set(name, uuid4().hex)
+
+
+class BeakerFragments(object):
+    """Storage for rendered fragments in the Beaker cache of the current request (web.core.cache).
+
+    Fragments are shared by every process using the same Beaker cache.  If no Beaker cache is
+    available nothing is cached.
+    """
+
+    def __init__(self, namespace='web.templating', ttl=None):
+        self.namespace = namespace
+        self.ttl = ttl
+
+    def _cache(self):
+        import web.core
+
+        try:
+            return web.core.cache.get_cache(self.namespace)
+        except TypeError:
+            return None
+
+    def _get(self, key):
+        cache = self._cache()
+
+        try:
+            return cache.get(sha1(repr(key)).hexdigest()) if cache is not None else None
+        except KeyError:
+            return None
+
+    def _set(self, key, value, ttl=None):
+        cache = self._cache()
+        ttl = ttl or self.ttl
+
+        if cache is not None:
+            cache.put(sha1(repr(key)).hexdigest(), value, **(dict(expiretime=ttl) if ttl else dict()))
+
+    def get(self, key):
+        return self._get(('fragment', key))
+
+    def set(self, key, value, ttl=None):
+        self._set(('fragment', key), value, ttl)
+
+    def tag(self, name):
+        token = self._get(('tag', name))
+
+        if token is None:
+            token = uuid4().hex
+            self._set(('tag', name), token)
+
+        return token
+
+    def invalidate(self, name):
+        self._set(('tag', name), uuid4().hex)
+
+
+fragments = MemoryFragments()
+
+
+def invalidate(*tags):
+    """Invalidate all cached fragments rendered with any of the given tags."""
+
+    for tag in tags:
+        fragments.invalidate(tag)
+
+
+def _fragment(template, key, ttl, tags, produce):
+    """Return the cached result of produce(), calling it and caching the result if needed.
+
+    A result of None is never cached.
+
+    Results are cached by template, key, and the active locale, and remain valid until they expire
+    or one of their tags is invalidated.
+    """
+
+    translator = getattr(current(), 'translator', None)
+    key = (template, key, tuple(getattr(translator, 'lang', None) or ()))
+    tokens = tuple(fragments.tag(i) for i in tags)
+
+    entry = fragments.get(key)
+
+    if entry is not None and entry[0] == tokens:
+        return entry[1]
+
+    value = produce()
+
+    if value is not None:
+        fragments.set(key, (tokens, value), ttl)
+
+    return value
+
+
+def _variables(template, variables, extras):
+    """Supplement the given variables with the WebCore globals, and the options with the translator."""
+
+    global _namespace
+
+    generation = getattr(registry, 'generation', None)
+
+    # The registry may have been replaced by a plain list, which does not count modifications.
+    key = (id(registry), generation) if generation is not None else tuple(id(i) for i in registry)
+    cached, base, steps = _namespace
+
+    if cached != key:
+        base, steps = _compile()
+        _namespace = (key, base, steps)
+
+    data = dict(lookup=_lookup, relative=_relative(template))
+    data.update(base)
+
+    for i in steps:
+        data.update(i() if callable(i) else i)
+
+    data.update(variables)
+
+    environ = getattr(current(), 'environ', None)
+
+    if environ and 'web.translator' in environ:
+        extras.setdefault('i18n', environ['web.translator'])
 
+    return data
 
-def render(template, variables, **extras):
+
+def render(template, variables, cache_key=None, cache_ttl=None, cache_tags=(), **extras):
     """Renders a template using marrow.templating while supplementing the
     given variables with the WebCore globals. Keyword arguments, if any, are
     supplied to the renderer as renderer options.
+
+    If a cache_key is given the result is cached in the fragment cache by
+    template, key, and locale, optionally expiring after cache_ttl seconds or
+    when any of the cache_tags are invalidated.
     """
 
+    if cache_key is not None:
+        return _fragment(template, cache_key, cache_ttl, cache_tags, lambda: render(template, variables, **extras))
+
+    # JSON is serialized using the configured codec; the options of the JSON engine it replaces are
+    # honoured rather than passed to the codec.
+    if template == 'json:':
+        content_type = extras.pop('content_type', 'application/json')
+        extras.pop('i18n', None)
+
+        return content_type, codec.dumps(variables, **extras)
+
     # Do not add any extra data or options to serializers
     if not template.endswith(':'):
-        data = dict(
-                lookup=_lookup,
-                relative=_relative(template)
-            )
+        variables = _variables(template, variables, extras)
+
+    return _render(template, variables, **extras)
 
-        for i in registry:
-            if callable(i):
-                data.update(i())
-            else:
-                data.update(i)
 
-        data.update(variables)
-        variables = data
+def _stream_genshi(engine, filename, data, kind='markup', **options):
+    from genshi.input import ET, HTML, XML
+    from genshi.template import TextTemplate, MarkupTemplate
 
-        if request and 'web.translator' in request.environ:
-            extras.setdefault('i18n', request.environ['web.translator'])
+    method = options.get('method', 'text' if kind == 'text' else 'xhtml')
+    content_type = options.get('content_type', b'text/plain' if kind == 'text' else b'text/html')
 
-    return _render(template, variables, **extras)
+    data.update({'ET': ET, 'HTML': HTML, 'XML': XML})
+
+    loader, filename = engine.prepare(filename, kind=kind, **options)
+    tmpl = loader.load(filename, cls=TextTemplate if kind == 'text' else MarkupTemplate)
+
+    return content_type, tmpl.generate(**data).serialize(method)
+
+
+def _stream_jinja2(engine, filename, data, content_type=b'text/html', **options):
+    return content_type, engine.environment.get_template(filename).generate(data)
+
+
+streamers = dict(
+        genshi = _stream_genshi,
+        jinja2 = _stream_jinja2
+    )
+
+
+def stream(template, variables, **extras):
+    """As per render, but returns the content type and an iterable of unicode or string chunks.
+
+    Engines with an entry in the streamers dictionary generate their output incrementally; the
+    output of any other engine or serializer is returned as a single chunk.
+    """
+
+    name, filename = resolve(template)
+    streamer = streamers.get(name, None)
+
+    if streamer is None or filename is None:
+        content_type, output = render(template, variables, **extras)
+        return content_type, [output]
+
+    variables = _variables(template, variables, extras)
+
+    engine = _render[name]
+    options = dict(getattr(engine, 'options', None) or dict())
+    options.update(extras)
+
+    return streamer(engine, filename, variables, **options)
+
+
+def _chunked(output, encoding, size=8192):
+    """Encode the given iterable of chunks, returning a generator of strings of roughly the given size.
+
+    The request context active when this is called is made active again while generating output,
+    as iteration happens after the WebCore middleware stack has returned.  Objects registered with
+    the request's registry, and database sessions, are released once the response is closed.
+    """
+
+    context = current()
+
+    def generate(iterator):
+        buffer, length = [], 0
 
+        while iterator is not None:
+            previous = activate(context)
 
-def template(template, **extras):
+            try:
+                for chunk in iterator:
+                    if isinstance(chunk, unicode):
+                        chunk = chunk.encode(encoding)
+
+                    buffer.append(chunk)
+                    length += len(chunk)
+
+                    if length >= size:
+                        break
+
+                else:
+                    iterator = None
+
+            finally:
+                activate(previous)
+
+            if buffer:
+                yield b''.join(buffer)
+                buffer, length = [], 0
+
+    return generate(iter(output))
+
+
+def template(template, cache_key=None, cache_ttl=None, cache_tags=(), **extras):
     """Decorates a function to output a rendered template, just like a
     controller method. Keyword arguments, if any, are supplied to the renderer
     as renderer options.
+
+    If a cache_key is given the rendered output is cached as per render.  The
+    key may be a callable, which is passed the arguments of the decorated
+    function; if the output for the resulting key is cached, the decorated
+    function is not called at all.
     """
     def outer(func):
         @wraps(func)
         def inner(*args, **kw):
-            result = func(*args, **kw)
-            if not isinstance(result, dict):
-                return result
+            if cache_key is None:
+                result = func(*args, **kw)
+                if not isinstance(result, dict):
+                    return result
+
+                return render(template, result, **extras)[1]
+
+            key = cache_key(*args, **kw) if callable(cache_key) else cache_key
+            uncached = []
+
+            def produce():
+                result = func(*args, **kw)
+                if not isinstance(result, dict):
+                    uncached.append(result)
+                    return None
+
+                return render(template, result, **extras)[1]
 
-            return render(template, result, **extras)[1]
+            output = _fragment(template, key, cache_ttl, cache_tags, produce)
+            return uncached[0] if uncached else output
 
         return inner
 
     return outer
 
 
+def _discover(source):
+    """Generate the filenames of all files within a package's templates directory, or a given directory."""
+
+    base = source if os.path.isdir(source) else resource_filename(source, 'templates')
+
+    for path, directories, files in os.walk(base):
+        for name in files:
+            yield os.path.join(path, name)
+
+
+def _reserve(cache, size):
+    """Grow a bounded cache, if needed, to hold at least the given number of entries."""
+
+    capacity = getattr(cache, 'capacity', None)
+
+    if capacity is not None and capacity < size:
+        log.debug("Growing template cache from %d to %d entries.", capacity, size)
+        cache.capacity = size
+
+
+def _warm(engine, filename, size):
+    mtime = os.stat(filename).st_mtime
+    prepared = engine.prepare(filename, **dict(engine.options))
+
+    with _warming:
+        engine.cache[filename] = prepared, mtime
+
+
+def _warm_genshi(engine, filename, size):
+    from genshi.template import MarkupTemplate
+
+    mtime = os.stat(filename).st_mtime
+
+    with _warming:
+        prepared = engine.prepare(filename, **dict(engine.options))
+        engine.cache[filename] = prepared, mtime
+
+        # Each template loader keeps its own bounded cache of loaded templates.
+        _reserve(getattr(prepared[0], '_cache', None), size)
+
+    loader, filename = prepared
+    loader.load(filename, cls=MarkupTemplate)
+
+
+def _warm_jinja2(engine, filename, size):
+    with _warming:
+        _reserve(getattr(engine.environment, 'cache', None), size)
+
+    engine.environment.get_template(filename)
+
+
+def _resident(engine, filename):
+    return filename in engine.cache
+
+
+_warming = Lock()
+
+warmers = dict(
+        genshi = _warm_genshi,
+        jinja2 = _warm_jinja2
+    )
+
+# Functions determining if a precompiled template is still cached; jinja2 caches within its environment.
+residents = dict(
+        jinja2 = lambda engine, filename: True
+    )
+
+# The sources and result of the last precompilation performed by the TemplatingMiddleware.
+precompiled = None
+
+# Template file extensions and the engine used to precompile them; None is the default engine.
+extensions = dict(
+        html = None,
+        htm = None,
+        xhtml = None,
+        xml = None,
+        mako = 'mako',
+        jinja2 = 'jinja2'
+    )
+
+
+def precompile(sources, threads=4, exclude=()):
+    """Load and compile templates ahead of their first use, returning the number compiled and failed.
+
+    Each source is the name of a package, whose templates directory is searched, or the path to a
+    directory.  The engine is chosen by file extension using the extensions dictionary; engines
+    named in exclude are skipped.  Templates are compiled in parallel on the given number of threads.
+
+    The template caches of each engine are grown to hold every template found; templates which are
+    nonetheless no longer cached once compilation completes are counted as failed.
+    """
+
+    jobs = []
+    engines = dict()
+
+    for source in sources:
+        for filename in _discover(source):
+            name = extensions.get(os.path.splitext(filename)[1][1:].lower(), False)
+
+            if name is False:
+                continue
+
+            name = name or resolve.default
+
+            if name in exclude:
+                continue
+
+            if name not in engines:
+                try:
+                    engines[name] = _render[name]
+                except Exception:
+                    log.warn("Unable to load the %s templating engine; not precompiling its templates.", name, exc_info=True)
+                    engines[name] = None
+
+            if engines[name] is not None:
+                jobs.append((name, filename))
+
+    sizes = dict()
+
+    for name, filename in jobs:
+        sizes[name] = sizes.get(name, 0) + 1
+
+    for name, size in sizes.items():
+        # Genshi also caches a template loader for each directory.
+        _reserve(engines[name].cache, size + len(set(os.path.dirname(j) for i, j in jobs if i == name)))
+
+    def warm(job):
+        name, filename = job
+
+        try:
+            warmers.get(name, _warm)(engines[name], filename, sizes[name])
+        except Exception:
+            log.warn("Unable to precompile %s template: %s", name, filename, exc_info=True)
+            return False
+
+        return True
+
+    if threads > 1 and len(jobs) > 1:
+        from multiprocessing.pool import ThreadPool
+
+        pool = ThreadPool(min(threads, len(jobs)))
+
+        try:
+            results = pool.map(warm, jobs)
+        finally:
+            pool.close()
+            pool.join()
+
+    else:
+        results = [warm(i) for i in jobs]
+
+    for i, (name, filename) in enumerate(jobs):
+        if results[i] and not residents.get(name, _resident)(engines[name], filename):
+            log.warn("Precompiled %s template was evicted from the cache: %s", name, filename)
+            results[i] = False
+
+    compiled = results.count(True)
+    log.info("Precompiled %d templates, %d failed.", compiled, len(results) - compiled)
+
+    return compiled, len(results) - compiled
+
+
 class TemplatingMiddleware(object):
     def __init__(self, application, config=dict(), **kw):
         self.config = config.copy()
         self.config.update(kw)
         self.application = application
 
+        self.stream = boolean(config.get('web.templating.stream', False))
         resolve.default = config.get('web.templating.engine', 'genshi')
+        resolve.revalidate = boolean(config.get('web.templating.revalidate', config.get('debug', False)))
+        resolve.cache.capacity = integer(config.get('web.templating.cache', 1024))
+
+        global fragments
+
+        if config.get('web.templating.fragments', 'memory') == 'beaker':
+            fragments = BeakerFragments(ttl=integer(config.get('web.templating.fragments.ttl', 0)) or None)
+        else:
+            fragments = MemoryFragments(
+                    integer(config.get('web.templating.fragments.capacity', 256)),
+                    integer(config.get('web.templating.fragments.ttl', 0)) or None
+                )
+
+        refresh()
+
+        self.precompile(config)
+
+    def precompile(self, config):
+        """Precompile templates at startup if enabled by the web.templating.precompile option.
+
+        This may be a boolean, to precompile the templates of the root controller's package, or a
+        list of package names.
+        """
+
+        value = config.get('web.templating.precompile', False)
+
+        try:
+            if not boolean(value):
+                return
+
+            root = config.get('web.root.package') or getattr(config.get('web.root'), '__module__', None)
+
+            if not root:
+                log.warn("Unable to determine the root package; not precompiling templates.")
+                return
+
+            sources = [root.split('.', 1)[0]]
+
+        except ValueError:
+            sources = array(value)
+
+        # Genshi template loaders are bound to the translator when first created.
+        exclude = ('genshi', ) if defaultbool(config.get('web.locale.i18n', False), ['gettext']) else ()
+
+        global precompiled
+        precompiled = sources, precompile(sources, integer(config.get('web.templating.precompile.threads', 4)), exclude)
 
     def __call__(self, environ, start_response):
         result = self.application(environ, start_response)
@@ -98,6 +723,17 @@ class TemplatingMiddleware(object):
         if not isinstance(template, basestring) or not isinstance(extras, dict):
             raise TypeError("Invalid tuple values returned to TemplatingMiddleware.")
 
+        extras = dict(extras)
+
+        if extras.pop('stream', self.stream):
+            response.content_type, output = stream(template, data, **extras)
+
+            if isinstance(response.content_type, unicode):
+                response.content_type = response.content_type.encode('iso-8859-1')
+
+            response.app_iter = _chunked(output, response.charset or 'utf-8')
+            return response(environ, start_response)
+
         response.content_type, output = render(template, data, **extras)
         
         if isinstance(response.content_type, unicode):
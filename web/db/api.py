@@ -6,6 +6,8 @@
 import warnings
 import re
 
+from web.core.context import ClosingIterator, streamed
+
 
 __all__ = ['TransactionalMiddlewareInterface']
 log = __import__('logging').getLogger(__name__)
@@ -54,6 +56,14 @@ class TransactionalMiddlewareInterface(object):
         """Called if the vote failed."""
         raise NotImplementedError
     
+    def release(self, environ):
+        """Called after the transaction has been committed or aborted and the response generated.
+        
+        For streamed responses this happens once the response has been closed, allowing the
+        response to use the session while it is generated.
+        """
+        pass
+    
     def __call__(self, environ, start_response):
         log.debug("Preparing database session.")
         
@@ -65,12 +75,28 @@ class TransactionalMiddlewareInterface(object):
             status.append(int(stat_str.split(' ')[0]))
             return start_response(stat_str, headers)
         
+        deferred = False
+        
         try:
             result = self.application(environ, local_start)
+            deferred = streamed(result)
+        
         finally:
-            if self.vote(environ, status[0] if status else None):
-                self.finish(environ)
-            else:
-                self.abort(environ)
+            try:
+                if self.vote(environ, status[0] if status else None):
+                    self.finish(environ)
+                else:
+                    self.abort(environ)
+            
+            except:
+                deferred = False
+                raise
+            
+            finally:
+                if not deferred:
+                    self.release(environ)
+        
+        if deferred:
+            return ClosingIterator(result, lambda: self.release(environ))
         
         return result
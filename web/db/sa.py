@@ -1,20 +1,137 @@
 # encoding: utf-8
 
-"""SQLAlchemy transactional database integration."""
+"""SQLAlchemy transactional database integration.
+
+The session for each request is only created when first used; requests which never use it do not
+create, commit, or close a session.  The number of sessions created during a request is available
+as environ['web.db.sessions'].
+
+Reads may be spread across read-only replicas of the database by listing their URLs in the
+`db.X.replicas` configuration option.  Each session then sends queries to a replica, chosen
+round-robin or by fewest checked-out connections (`db.X.replicas.strategy = leastconn`), until
+the first write, after which the primary is used for the remainder of the request.  Requests
+using an HTTP method other than GET, HEAD, or OPTIONS use the primary throughout.
+"""
 
 
 import warnings
+import itertools
 import api
 
 from sqlalchemy import engine_from_config, event
-from sqlalchemy.orm import sessionmaker
-from marrow.util.convert import boolean
+from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy.sql.expression import Select, CompoundSelect, TextClause
+from marrow.util.convert import boolean, array
 from marrow.util.object import load_object
 
 
-__all__ = ['SQLAlchemyMiddleware']
+__all__ = ['LazySession', 'ReplicaRouter', 'RoutingSession', 'SQLAlchemyMiddleware']
 log = __import__('logging').getLogger(__name__)
 
+safe_methods = ('GET', 'HEAD', 'OPTIONS')
+
+
+def _reads(clause):
+    """Determine if executing the given clause only reads from the database."""
+    
+    if isinstance(clause, (Select, CompoundSelect)):
+        return getattr(clause, '_for_update_arg', None) is None
+    
+    if isinstance(clause, TextClause):
+        return clause.text.lstrip().upper().startswith('SELECT')
+    
+    return False
+
+
+def _checkedout(engine):
+    checkedout = getattr(engine.pool, 'checkedout', None)
+    return checkedout() if checkedout else 0
+
+
+class ReplicaRouter(object):
+    """Choose a read replica for each session, round-robin or by fewest checked-out connections."""
+    
+    strategies = ('roundrobin', 'leastconn')
+    
+    def __init__(self, replicas, strategy='roundrobin'):
+        if strategy not in self.strategies:
+            raise ValueError("Unknown replica strategy %r; use one of: %s" % (strategy, ", ".join(self.strategies)))
+        
+        self.replicas = replicas
+        self.strategy = strategy
+        self._cycle = itertools.cycle(replicas)
+    
+    def choose(self):
+        if self.strategy == 'leastconn':
+            return min(self.replicas, key=_checkedout)
+        
+        return next(self._cycle)
+
+
+class RoutingSession(Session):
+    """A session which reads from a replica until the first write, then uses the primary.
+    
+    A write is a flush, or the execution of anything other than a SELECT statement.
+    """
+    
+    def __init__(self, router=None, primary=False, **kw):
+        super(RoutingSession, self).__init__(**kw)
+        
+        self.router = router
+        self.replica = None
+        self.primary = primary or router is None
+    
+    def get_bind(self, mapper=None, clause=None):
+        if not self.primary and (self._flushing or not _reads(clause)):
+            log.debug("Using the primary database for the remainder of the session.")
+            self.primary = True
+        
+        if self.primary:
+            return super(RoutingSession, self).get_bind(mapper, clause)
+        
+        if self.replica is None:
+            self.replica = self.router.choose()
+        
+        return self.replica
+
+
+class LazySession(object):
+    """A stand-in for a SQLAlchemy session which creates the session on first use."""
+    
+    __slots__ = ('_factory', '_session')
+    
+    def __init__(self, factory):
+        object.__setattr__(self, '_factory', factory)
+        object.__setattr__(self, '_session', None)
+    
+    @property
+    def created(self):
+        return self._session is not None
+    
+    def _current_obj(self):
+        if self._session is None:
+            object.__setattr__(self, '_session', self._factory())
+        
+        return self._session
+    
+    def __getattr__(self, name):
+        return getattr(self._current_obj(), name)
+    
+    def __setattr__(self, name, value):
+        setattr(self._current_obj(), name, value)
+    
+    def __delattr__(self, name):
+        delattr(self._current_obj(), name)
+    
+    def __contains__(self, instance):
+        return instance in self._current_obj()
+    
+    def __iter__(self):
+        return iter(self._current_obj())
+    
+    def __repr__(self):
+        return repr(self._current_obj())
+
 
 class SQLAlchemyMiddleware(api.TransactionalMiddlewareInterface):
     def __init__(self, application, prefix, model, session, **config):
@@ -37,6 +154,21 @@ class SQLAlchemyMiddleware(api.TransactionalMiddlewareInterface):
                 twophase = boolean(self.config.get('%s.twophase' % (self.prefix, ), False)),
             )
         
+        self.router = None
+        replicas = array(self.config.get('%s.replicas' % (self.prefix, ), None) or [])
+        
+        if replicas:
+            engines = []
+            
+            for url in replicas:
+                config = dict(self.config)
+                config['%s.sqlalchemy.url' % (self.prefix, )] = url
+                engines.append(engine_from_config(config, prefix="%s.sqlalchemy." % (self.prefix, )))
+            
+            self.model.__dict__['replicas'] = engines
+            self.router = ReplicaRouter(engines, self.config.get('%s.replicas.strategy' % (self.prefix, ), 'roundrobin'))
+            args.update(class_=RoutingSession, router=self.router)
+        
         setup = getattr(self.model, 'setup', None)
         if hasattr(setup, '__call__'):
             warnings.warn("Use of the hard-coded 'setup' callback is deprecated.\n"
@@ -63,9 +195,19 @@ class SQLAlchemyMiddleware(api.TransactionalMiddlewareInterface):
             
             if hasattr(cb, '__call__'):
                 cb(self._session)
-
+    
     def begin(self, environ):
-        environ['paste.registry'].register(self.session, self._session())
+        def factory():
+            environ['web.db.sessions'] = environ.get('web.db.sessions', 0) + 1
+            log.debug("Creating %s database session.", self.prefix)
+            
+            if self.router is not None:
+                return self._session(primary=environ['REQUEST_METHOD'] not in safe_methods)
+            
+            return self._session()
+        
+        environ.setdefault('web.db.sessions', 0)
+        environ['paste.registry'].register(self.session, LazySession(factory))
     
     def vote(self, environ, status):
         if status >= 400:
@@ -76,16 +218,27 @@ class SQLAlchemyMiddleware(api.TransactionalMiddlewareInterface):
         return True
     
     def finish(self, environ):
+        if not self.session._current_obj().created:
+            return
+        
         if self.session.transaction is not None: # use getattr
             self.session.commit()
-        self.session.close()
     
     def abort(self, environ):
+        if not self.session._current_obj().created:
+            return
+        
+        self.session.rollback()
+    
+    def release(self, environ):
+        if not self.session._current_obj().created:
+            return
+        
         self.session.close()
     
     def populate_table(self, target, connection, **kw): # pragma: no cover
         """Deprecated."""
-        session = self._session()
+        session = self._session(primary=True) if self.router is not None else self._session()
         
         try:
             self.model.populate(session, target.name)
@@ -4,8 +4,9 @@
 
 import web
 
+from threading import Lock
 from functools import wraps
-from web.rpc import route
+from web.rpc import route, routes, Routable
 
 try:
     import pyamf.remoting.gateway
@@ -17,12 +18,55 @@ except ImportError: # pragma: no cover
 __all__ = ['AMFController']
 log = __import__('logging').getLogger(__name__)
 
+_registering = Lock()
 
-class AMFController(web.core.Dialect):
+
+class AMFController(Routable, web.core.Dialect):
+    """A Flash Remoting (AMF) gateway to the methods of a controller tree.
+    
+    Methods are registered with the gateway on first use.  If __eager__ is True every routable
+    method is registered by __ready__ instead, avoiding the cost on the first request to each
+    method.  The Application calls __ready__ on the root controller once it has been constructed,
+    so that child controllers assigned by the __init__ of a subclass are included; call it yourself
+    for a controller which is not the root, or registration happens on the first request.
+    """
+    
     __gateway__ = dict()
+    __eager__ = False
     
     def __init__(self):
         self._gateway = pyamf.remoting.gateway.BaseGateway(logger=log, *self.__gateway__)
+        self._processors = dict()
+        self._registered = not self.__eager__
+    
+    def __ready__(self):
+        if not self._registered:
+            self._register()
+    
+    def _register(self):
+        """Register every method routable from this controller with the gateway."""
+        
+        with _registering:
+            if self._registered:
+                return
+            
+            for name, fn, parent in routes(self, AMFController):
+                if name not in self._gateway.services:
+                    self._gateway.addService(self._call(fn, parent), name)
+            
+            self._registered = True
+        
+        log.debug("Registered %d AMF services.", len(self._gateway.services))
+    
+    def _processor(self, message):
+        """Return the request processor for the given message, reusing one per message type."""
+        
+        kind = message.target == 'null' or not message.target
+        
+        try:
+            return self._processors[kind]
+        except KeyError:
+            return self._processors.setdefault(kind, self._gateway.getProcessor(message))
     
     def _call(self, fn, parent):
         @wraps(fn)
@@ -45,14 +89,16 @@ class AMFController(web.core.Dialect):
         pyamf_request = pyamf.remoting.decode(request.body)
         pyamf_response = pyamf.remoting.Envelope(pyamf_request.amfVersion)
         
+        if not self._registered:
+            self._register()
+        
         for name, message in pyamf_request:
-            # Dynamically build mapping.
-            # This introduces a performance hit on the first request of each method.
+            # Build the mapping for methods not registered in advance.
             if message.target not in self._gateway.services:
                 fn, parent = route(self, message.target, AMFController)
                 self._gateway.addService(self._call(fn, parent), message.target)
             
-            pyamf_response[name] = self._gateway.getProcessor(message)(message)
+            pyamf_response[name] = self._processor(message)(message)
         
         web.core.response.headers['Content-Type'] = pyamf.remoting.CONTENT_TYPE
         
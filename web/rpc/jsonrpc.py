@@ -1,35 +1,116 @@
 # encoding: utf-8
 
-"""A JSON-RPC Dialect class."""
+"""A JSON-RPC Dialect class.
+
+Single calls are answered in the original JSON-RPC format.  A JSON-RPC 2.0 batch, a JSON array of
+call objects, is answered with an array of JSON-RPC 2.0 response objects in the same order as the
+calls; calls without an id (notifications) produce no response object.
+
+If the `web.rpc.json.threads` configuration option is set to a positive integer, the calls of a
+batch are executed in parallel on a pool of that many threads.  The calls must then be independent
+of one another; each runs within the context of the batch request, sharing the request and
+response objects, and with the objects registered with the request's paste registry.
+
+SQLAlchemy sessions are not thread-safe, so batches are always executed serially when a database
+session has been prepared for the request (i.e. when SQLAlchemy database middleware is configured).
+"""
+
+from threading import Lock
 
 import web.core
+import web.core.context
 
 from web.core import Dialect
 from web.core.http import HTTPBadRequest, HTTPMethodNotAllowed
-from web.rpc import route
+from web.rpc import route, resolve, Routable, RoutingError
 from marrow.util.compat import exception
-
-try:
-    from simplejson import loads
-except ImportError:
-    from json import loads
+from marrow.util.convert import integer
+from web.utils import codec
 
 
+__all__ = ['JSONRPCController']
 log = __import__('logging').getLogger(__name__)
 
+_pools = dict()
+_pool_lock = Lock()
+
+
+error = dict(
+        invalid = (-32600, "Invalid Request"),
+        notfound = (-32601, "Method not found"),
+        params = (-32602, "Invalid params"),
+        internal = (-32603, "Internal error"),
+        application = (-32000, "Server error")
+    )
+
+
+def pool():
+    """Return the shared thread pool used to execute batched calls, or None if disabled.
+    
+    One pool is kept for each configured number of threads.
+    """
+    
+    threads = integer(web.core.config.get('web.rpc.json.threads', 0))
+    
+    if not threads:
+        return None
+    
+    with _pool_lock:
+        if threads not in _pools:
+            from multiprocessing.pool import ThreadPool
+            
+            log.debug("Starting JSON-RPC batch pool of %d threads.", threads)
+            _pools[threads] = ThreadPool(threads)
+        
+        return _pools[threads]
+
+
+def registered(environ):
+    """Return the (proxy, object) pairs registered with the paste registry for the current request."""
+    
+    reglist = getattr(environ.get('paste.registry', None), 'reglist', None)
+    
+    if not reglist:
+        return []
+    
+    return reglist[-1].values()
+
+
+def prepare(context):
+    """Construct the lazily created objects of a context before it is shared between threads.
+    
+    A factory is removed from the context before it is called, so a second thread accessing the
+    object at the same moment would find neither.  A factory which fails is restored, leaving the
+    error to be reported by the call which uses it.
+    """
+    
+    for name, factory in list(context.factories.items()):
+        try:
+            getattr(context, name)
+        
+        except Exception:
+            log.debug("Unable to prepare %s for a parallel JSON-RPC batch.", name, exc_info=True)
+            context.factories.setdefault(name, factory)
 
-class JSONRPCController(Dialect):
+
+class JSONRPCController(Routable, Dialect):
     def __call__(self, request):
-        """Parse an XML-RPC body and dispatch."""
+        """Parse a JSON-RPC body and dispatch."""
         
         if request.method != 'POST':
             raise HTTPMethodNotAllowed("POST required.")
         
         try:
-            json = loads(request.body)
+            json = codec.load(request.body_file)
         except ValueError:
             raise HTTPBadRequest("Unable to parse JSON request.")
         
+        if isinstance(json, list):
+            return self._batch(json)
+        
+        if not isinstance(json, dict):
+            raise HTTPBadRequest("Unable to parse JSON request.")
+        
         for key in ('method', 'params'):
             if key not in json:
                 raise HTTPBadRequest("Missing required JSON-RPC value: " + key)
@@ -80,3 +161,139 @@ class JSONRPCController(Dialect):
             return 'json:', dict(result=result, error=None, id=id)
         
         return ''
+    
+    def _batch(self, calls):
+        """Execute a JSON-RPC 2.0 batch, returning the list of responses in call order."""
+        
+        log.debug("JSON-RPC Batch of %d calls.", len(calls))
+        
+        web.core.response.content_type = 'application/json'
+        
+        if not calls:
+            return 'json:', self._error(None, error['invalid'])
+        
+        workers = pool() if len(calls) > 1 else None
+        context = web.core.context.current()
+        
+        if workers is not None and 'web.db.sessions' in context.environ:
+            log.debug("Executing JSON-RPC batch serially; database sessions can not be shared between threads.")
+            workers = None
+        
+        if workers is None:
+            results = [self._execute(call) for call in calls]
+        
+        else:
+            prepare(context)
+            objects = registered(context.environ)
+            results = workers.map(lambda call: self._execute(call, context, objects), calls)
+        
+        results = [i for i in results if i is not None]
+        
+        if not results:
+            return ''
+        
+        return 'json:', results
+    
+    def _error(self, id, fault, data=None):
+        code, message = fault
+        result = dict(code=code, message=message)
+        
+        if data is not None:
+            result['data'] = data
+        
+        return dict(jsonrpc="2.0", error=result, id=id)
+    
+    def _execute(self, call, context=None, objects=()):
+        """Execute a single call object of a batch, returning the response object, if any.
+        
+        If a context is given it is made active for the duration of the call, and the given
+        (proxy, object) pairs are registered for the current thread.
+        """
+        
+        if context is not None:
+            previous = web.core.context.activate(context)
+        
+        for proxy, obj in objects:
+            proxy._push_object(obj)
+        
+        try:
+            return self._invoke(call)
+        
+        finally:
+            for proxy, obj in reversed(objects):
+                proxy._pop_object(obj)
+            
+            if context is not None:
+                web.core.context.activate(previous)
+    
+    def _invoke(self, call):
+        if not isinstance(call, dict) or not isinstance(call.get('method', None), basestring):
+            return self._error(None, error['invalid'])
+        
+        notification = 'id' not in call
+        id = call.get('id', None)
+        method = call['method']
+        params = call.get('params', [])
+        
+        if isinstance(params, list):
+            args, kw = params, dict()
+        elif isinstance(params, dict):
+            args, kw = [], dict((str(k), v) for k, v in params.iteritems())
+        else:
+            return None if notification else self._error(id, error['invalid'])
+        
+        log.debug("JSON-RPC Batch Call: %s%r%r", method, args, kw)
+        
+        try:
+            entry = resolve(self, method, JSONRPCController)
+        except RoutingError:
+            return None if notification else self._error(id, error['notfound'])
+        
+        func, parent = entry.callable, entry.parent
+        
+        if not self._acceptable(entry, args, kw):
+            return None if notification else self._error(id, error['params'])
+        
+        try:
+            callback = getattr(parent, '__before__', None)
+            if callback:
+                args = callback(*args)
+            
+            result = func(*args, **kw)
+            
+            callback = getattr(parent, '__after__', None)
+            if callback:
+                result = callback(result, *args)
+        
+        except:
+            exc = exception()
+            log.error("Error calling JSON-RPC method %s.", method, exc_info=True)
+            
+            if notification:
+                return None
+            
+            return self._error(id, (error['application'][0], str(exc.exception)),
+                    "Not disclosed." if not web.core.config.get('debug', False) else exc.formatted)
+        
+        if notification:
+            return None
+        
+        return dict(jsonrpc="2.0", result=result, id=id)
+    
+    def _acceptable(self, entry, args, kw):
+        """Determine if the given arguments satisfy the argspec of a routed method."""
+        
+        try:
+            names, defaults, unlimited, unlimited_kw = entry.argspec
+        except (TypeError, ValueError):
+            return True
+        
+        required = [i for i in names[len(args):] if i not in defaults]
+        
+        if not unlimited and len(args) > len(names):
+            return False
+        
+        if not unlimited_kw and [i for i in kw if i not in names]:
+            return False
+        
+        return not [i for i in required if i not in kw]
@@ -7,10 +7,9 @@ import xmlrpclib
 import web
 
 from marrow.util.bunch import Bunch
-from marrow.util.object import getargspec
 
 from web.core.http import HTTPLengthRequired, HTTPRequestEntityTooLarge
-from web.rpc import route, RoutingError
+from web.rpc import resolve, Routable, RoutingError
 
 
 __all__ = ['XMLRPCController']
@@ -37,9 +36,29 @@ fault = Bunch(
     )
 
 
-class XMLRPCController(web.core.Dialect):
+class DepthExceeded(ValueError):
+    pass
+
+
+class LimitedUnmarshaller(xmlrpclib.Unmarshaller):
+    """An XML-RPC unmarshaller which refuses to nest arrays and structures beyond a given depth."""
+
+    def __init__(self, depth, use_datetime=False):
+        xmlrpclib.Unmarshaller.__init__(self, use_datetime=use_datetime)
+        self.depth = depth
+
+    def start(self, tag, attrs):
+        if (tag == 'array' or tag == 'struct') and len(self._marks) >= self.depth:
+            raise DepthExceeded()
+
+        xmlrpclib.Unmarshaller.start(self, tag, attrs)
+
+
+class XMLRPCController(Routable, web.core.Dialect):
     __allow_none__ = False
     __max_body_length__ = 4194304
+    __max_depth__ = 32
+    __chunk_size__ = 65536
 
     def _fault(self, fault):
         """Return a formatted XML-RPC Fault response."""
@@ -63,36 +82,75 @@ class XMLRPCController(web.core.Dialect):
         web.core.response.content_type = 'text/xml'
         return value
 
+    def _parse(self, stream):
+        """Incrementally parse an XML-RPC request read from the given stream.
+
+        The body is read in chunks of __chunk_size__ bytes and fed to the parser, without being
+        buffered in full.  Parsing is aborted as soon as more than __max_body_length__ bytes have
+        been read, or values are nested more than __max_depth__ levels deep.
+        """
+
+        target = LimitedUnmarshaller(self.__max_depth__, use_datetime=True)
+        parser = xmlrpclib.FastParser(target) if xmlrpclib.FastParser else xmlrpclib.ExpatParser(target)
+        limit, chunk, remaining = self.__max_body_length__, self.__chunk_size__, self.__max_body_length__ + 1
+
+        while remaining > 0:
+            data = stream.read(min(chunk, remaining))
+
+            if not data:
+                break
+
+            remaining -= len(data)
+
+            if remaining <= 0:
+                log.debug("Request body larger than allowed maximum of %d bytes, "
+                          "returning 413 HTTPRequestEntityTooLarge error.", limit)
+                raise HTTPRequestEntityTooLarge("XML body too large.")
+
+            parser.feed(data)
+
+        parser.close()
+
+        return target.close(), target.getmethodname()
+
     def __call__(self, request):
         """Parse an XML-RPC body and dispatch."""
 
         length = int(request.headers.get('Content-Length', 0))
 
-        if not length:
+        # A terminated input stream (e.g. a chunked upload) may omit the length; the limit is
+        # enforced while reading.
+        if not length and not request.environ.get('wsgi.input_terminated', False):
             log.debug("No content length specified, returning 411 HTTPLengthRequired error.")
             raise HTTPLengthRequired()
 
-        if not length or length > self.__max_body_length__:
+        if length > self.__max_body_length__:
             log.debug("Content length larger than allowed maximum of %d bytes, "
                       "returning 413 HTTPRequestEntityTooLarge error.",
                       self.__max_body_length__)
             raise HTTPRequestEntityTooLarge("XML body too large.")
 
         try:
-            args, method = xmlrpclib.loads(request.body, True)
+            args, method = self._parse(request.body_file)
+        except DepthExceeded:
+            log.debug("XML-RPC request nested deeper than the allowed maximum of %d.", self.__max_depth__)
+            return self._fault(fault.server.invalid)
+        except HTTPRequestEntityTooLarge:
+            raise
         except:
             return self._fault(fault.parse.badly_formed)
 
         log.debug("XML-RPC Call: %s%r", method, args)
 
         try:
-            func, parent = route(self, method, XMLRPCController)
+            entry = resolve(self, method, XMLRPCController)
         except RoutingError:
             return self._fault(fault.server.notfound)
 
+        func, parent = entry.callable, entry.parent
         log.debug("Found method: %r", func)
 
-        cargs, cdefaults, unlimited = getargspec(func)[:3]
+        cargs, cdefaults, unlimited = entry.argspec[:3]
         cargs = len(cargs)
         cdefaults = len(cdefaults)
         nargs = len(args)
@@ -0,0 +1,123 @@
+# encoding: utf-8
+
+"""A bounded, thread-safe, least-recently-used cache."""
+
+import time
+
+from collections import OrderedDict
+from threading import Lock
+
+
+__all__ = ['LRUCache']
+
+_missing = object()
+
+
+class LRUCache(object):
+    """A least-recently-used (LRU) mapping with optional per-entry expiry.
+    
+    Discards the least recently referenced entry once the capacity is exceeded.  A capacity of
+    zero disables the cache entirely; nothing will be stored.
+    
+    If a ttl (in seconds) is given, entries older than this are treated as missing.  Individual
+    entries may override this when set.
+    
+    Unlike marrow.util.object.Cache, entries may be removed individually, and all operations are
+    guarded by a lock, making instances safe to share between request threads.
+    """
+    
+    def __init__(self, capacity=128, ttl=None):
+        super(LRUCache, self).__init__()
+        
+        self.capacity = capacity
+        self.ttl = ttl
+        
+        self._data = OrderedDict()
+        self._lock = Lock()
+    
+    def __repr__(self):
+        return "LRUCache(%r, %r) with %d entries" % (self.capacity, self.ttl, len(self._data))
+    
+    def __len__(self):
+        return len(self._data)
+    
+    def __contains__(self, key):
+        return self.get(key, _missing) is not _missing
+    
+    def __iter__(self):
+        with self._lock:
+            return iter(list(self._data))
+    
+    def __getitem__(self, key):
+        value = self.get(key, _missing)
+        
+        if value is _missing:
+            raise KeyError(key)
+        
+        return value
+    
+    def __setitem__(self, key, value):
+        self.set(key, value)
+    
+    def __delitem__(self, key):
+        with self._lock:
+            del self._data[key]
+    
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                expires, value = self._data.pop(key)
+            except KeyError:
+                return default
+            
+            if expires is not None and expires < time.time():
+                return default
+            
+            self._data[key] = (expires, value)
+        
+        return value
+    
+    def set(self, key, value, ttl=None):
+        if not self.capacity:
+            return value
+        
+        ttl = self.ttl if ttl is None else ttl
+        expires = (time.time() + ttl) if ttl else None
+        
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (expires, value)
+            
+            while len(self._data) > self.capacity:
+                self._data.popitem(last=False)
+        
+        return value
+    
+    def pop(self, key, default=None):
+        with self._lock:
+            expires, value = self._data.pop(key, (None, default))
+        
+        return value
+    
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+    
+    def invalidate(self, condition=None):
+        """Remove all entries whose key satisfies the given callable, or all entries if omitted.
+        
+        Returns the number of entries removed.
+        """
+        
+        with self._lock:
+            if condition is None:
+                count = len(self._data)
+                self._data.clear()
+                return count
+            
+            keys = [key for key in self._data if condition(key)]
+            
+            for key in keys:
+                del self._data[key]
+        
+        return len(keys)
@@ -0,0 +1,179 @@
+# encoding: utf-8
+
+"""Memory-mapped GNU gettext message catalogs.
+
+gettext.GNUTranslations reads an entire .mo file, decoding every message into a dictionary held by
+each process.  MMapTranslations instead maps the file into memory and locates messages with a binary
+search of its sorted table of original strings; the pages of the file are shared by all processes
+using it, such as pre-forked workers, and only the messages actually used are decoded.
+
+Use it by passing it as the class_ argument to gettext.translation, or, within WebCore, by setting
+the `web.locale.catalog` configuration option to `mmap`.
+"""
+
+import mmap
+
+from struct import unpack
+from gettext import GNUTranslations, c2py
+
+
+__all__ = ['MMapCatalog', 'MMapTranslations']
+
+_missing = object()
+
+
+class MMapCatalog(object):
+    """A read-only mapping of the messages in a memory-mapped .mo file.
+    
+    Keys and values are as for the _catalog dictionary of GNUTranslations: a message id for singular
+    messages, or a tuple of the singular message id and plural form index for plural ones.
+    """
+    
+    def __init__(self, buffer, count, originals, translations, format, charset=None):
+        self.buffer = buffer
+        self.count = count
+        self.originals = originals
+        self.translations = translations
+        self.format = format
+        self.charset = charset
+        
+        self._decoded = dict()
+    
+    def __len__(self):
+        return self.count
+    
+    def __contains__(self, key):
+        return self.get(key, _missing) is not _missing
+    
+    def __getitem__(self, key):
+        value = self._decoded.get(key, _missing)
+        
+        if value is not _missing:
+            return value
+        
+        plural = isinstance(key, tuple)
+        message, translation = self.find(key[0] if plural else key)
+        
+        if plural != ('\x00' in message):
+            raise KeyError(key)
+        
+        if plural:
+            try:
+                translation = translation.split('\x00')[key[1]]
+            except IndexError:
+                raise KeyError(key)
+        
+        if self.charset:
+            translation = unicode(translation, self.charset)
+        
+        self._decoded[key] = translation
+        return translation
+    
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+    
+    def entry(self, index):
+        """Return the raw original and translated strings of the entry at the given index."""
+        
+        buffer, format = self.buffer, self.format
+        
+        length, offset = unpack(format, buffer[self.originals + index * 8:self.originals + index * 8 + 8])
+        message = buffer[offset:offset + length]
+        
+        length, offset = unpack(format, buffer[self.translations + index * 8:self.translations + index * 8 + 8])
+        
+        return message, buffer[offset:offset + length]
+    
+    def find(self, message):
+        """Return the raw original and translated strings for the given message id.
+        
+        The table of original strings is sorted, allowing a binary search; the singular message id
+        of a plural message is compared in place of the full original string.
+        """
+        
+        if isinstance(message, unicode):
+            try:
+                message = message.encode(self.charset or 'ascii')
+            except UnicodeError:
+                raise KeyError(message)
+        
+        buffer, format, originals = self.buffer, self.format, self.originals
+        low, high = 0, self.count
+        
+        while low < high:
+            middle = (low + high) // 2
+            length, offset = unpack(format, buffer[originals + middle * 8:originals + middle * 8 + 8])
+            current = buffer[offset:offset + length].split('\x00', 1)[0]
+            
+            if current < message:
+                low = middle + 1
+            elif current > message:
+                high = middle
+            else:
+                return self.entry(middle)
+        
+        raise KeyError(message)
+
+
+class MMapTranslations(GNUTranslations):
+    """A GNUTranslations instance whose catalog is read on demand from a memory-mapped .mo file."""
+    
+    def _parse(self, fp):
+        filename = getattr(fp, 'name', '')
+        self.plural = lambda n: int(n != 1)
+        
+        buffer = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        
+        magic = unpack('<I', buffer[:4])[0]
+        
+        if magic == self.LE_MAGIC:
+            format = '<II'
+        elif magic == self.BE_MAGIC:
+            format = '>II'
+        else:
+            raise IOError(0, 'Bad magic number', filename)
+        
+        version, count, originals, translations = unpack(format[0] + '4I', buffer[4:20])
+        
+        if max(originals, translations) + count * 8 > len(buffer):
+            raise IOError(0, 'File is corrupt', filename)
+        
+        self._catalog = catalog = MMapCatalog(buffer, count, originals, translations, format)
+        
+        if not count:
+            return
+        
+        # The metadata, if present, has an empty message id and so is always the first entry.
+        message, metadata = catalog.entry(0)
+        
+        if message:
+            return
+        
+        lastk = None
+        
+        for item in metadata.splitlines():
+            item = item.strip()
+            
+            if not item:
+                continue
+            
+            k = v = None
+            
+            if ':' in item:
+                k, v = item.split(':', 1)
+                k = k.strip().lower()
+                v = v.strip()
+                self._info[k] = v
+                lastk = k
+            
+            elif lastk:
+                self._info[lastk] += '\n' + item
+            
+            if k == 'content-type':
+                self._charset = catalog.charset = v.split('charset=')[1]
+            
+            elif k == 'plural-forms':
+                self.plural = c2py(v.split(';')[1].split('plural=')[1])
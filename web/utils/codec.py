@@ -0,0 +1,112 @@
+# encoding: utf-8
+
+"""A registry of interchangeable JSON encoder/decoder implementations.
+
+The JSON-RPC dialect and the `json:` serializer use the active codec, selected by the
+`web.json.codec` configuration option.  A codec is any object (usually a module) providing
+`loads` and `dumps` functions compatible with the standard library json module; a `load`
+function accepting a file-like object is used if present.
+
+Codecs may be referenced by registered name or by dot-colon notation, e.g.:
+
+    web.json.codec = json
+    web.json.codec = myapp.lib.fastjson:codec
+
+By default simplejson is used if installed, otherwise the standard library json module.
+"""
+
+from marrow.util.object import load_object
+
+
+__all__ = ['Codec', 'codecs', 'register', 'use', 'current', 'loads', 'load', 'dumps']
+log = __import__('logging').getLogger(__name__)
+
+
+codecs = dict(
+        json = 'json',
+        simplejson = 'simplejson'
+    )
+
+
+class Codec(object):
+    """A named JSON encoder/decoder pair."""
+    
+    __slots__ = ('name', 'loads', 'dumps', 'load')
+    
+    def __init__(self, name, loads, dumps, load=None):
+        self.name = name
+        self.loads = loads
+        self.dumps = dumps
+        self.load = load if load is not None else (lambda fp, **kw: loads(fp.read(), **kw))
+    
+    def __repr__(self):
+        return "Codec(%r)" % (self.name, )
+    
+    @classmethod
+    def wrap(cls, name, obj):
+        """Build a Codec from an object (usually a module) with loads, dumps, and optionally load."""
+        
+        if isinstance(obj, cls):
+            return obj
+        
+        return cls(name, obj.loads, obj.dumps, getattr(obj, 'load', None))
+
+
+def register(name, codec):
+    """Register a codec under the given name.
+    
+    The codec may be a Codec instance, an object providing loads and dumps, or a string reference
+    to one, which will be imported when first used.
+    """
+    
+    codecs[name] = codec
+
+
+def _load(name):
+    codec = codecs.get(name, name)
+    
+    if isinstance(codec, basestring):
+        codec = load_object(codec) if ':' in codec else __import__(codec, fromlist=['loads'])
+    
+    return Codec.wrap(name, codec)
+
+
+def use(name=None):
+    """Select the active codec, returning it."""
+    
+    global _active
+    
+    if name is None:
+        try:
+            codec = _load('simplejson')
+        except ImportError:
+            codec = _load('json')
+    
+    else:
+        codec = _load(name)
+    
+    log.debug("Using %r for JSON encoding and decoding.", codec)
+    _active = codec
+    
+    return codec
+
+
+def current():
+    """Return the active Codec."""
+    
+    return _active
+
+
+def loads(data, **kw):
+    return _active.loads(data, **kw)
+
+
+def load(fp, **kw):
+    return _active.load(fp, **kw)
+
+
+def dumps(obj, **kw):
+    return _active.dumps(obj, **kw)
+
+
+_active = use()